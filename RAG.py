@@ -1,51 +1,230 @@
 # RAG.py
-from llama_index.core import SimpleDirectoryReader, GPTVectorStoreIndex
-from llama_index.core import StorageContext, load_index_from_storage
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-from llama_index.core.settings import Settings
-Settings.llm = None
+from embedding_store import EmbeddingStore, STORE_DIR, mmr, resolve_store, store_exists
+from bm25_index import BM25Index, reciprocal_rank_fusion
+from models import Passage
+from caching import normalize_question
+from shard_registry import DEFAULT_PERSONA, SHARDS, ShardRegistry, parse_shards
+from embedding_backends import load_embed_model
+from metrics import stage
+import os
+import re
+import threading
 
-# Use a specific embedding model
-embed_model = HuggingFaceEmbedding(model_name="sentence-transformers/all-MiniLM-L6-v2")
+import numpy as np
 
-def initialize_index():
+EMBED_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+SIMILARITY_TOP_K = 3
+# Candidates taken from each of the vector and BM25 rankings before fusion
+CANDIDATE_K = 20
+# When > 0, only the top BM25 matches are scored against the query vector
+LEXICAL_PREFILTER_K = int(os.getenv("RAG_LEXICAL_PREFILTER_K", "0"))
+# Fused candidates the final top_k are diversified from with MMR
+MMR_POOL_K = int(os.getenv("RAG_MMR_POOL_K", "20"))
+# 1.0 ranks by relevance only; lower values favour passages unlike those already picked
+MMR_LAMBDA = float(os.getenv("RAG_MMR_LAMBDA", "0.7"))
+
+# Use a specific embedding model, loaded on first use (see warm_up)
+embed_model = None
+_embed_model_lock = threading.Lock()
+
+def get_embed_model():
+    """
+    Load the embedding model once, on the backend selected by
+    RAG_EMBED_BACKEND; torch and the weights are only imported here so
+    importing this module stays cheap.
     """
-    Initialize or load the index with Augustine's texts.
+    global embed_model
+    if embed_model is None:
+        with _embed_model_lock:
+            if embed_model is None:
+                embed_model = load_embed_model(EMBED_MODEL_NAME)
+    return embed_model
+
+def initialize_store(store_dir=STORE_DIR, allow_build=False):
+    """
+    Open the memory-mapped embedding store. With allow_build, a missing
+    default store is built from augustine_texts with the index pipeline;
+    the web service never does this, run rebuild_index.py instead.
     """
     try:
-        # Try to load the pre-built index
-        storage_context = StorageContext.from_defaults(persist_dir="./augustine_index")
-        index = load_index_from_storage(storage_context, embed_model=embed_model)
-        print("Loaded existing index from storage")
-    except Exception:
-        print("Building new index...")
-        # Load Augustine's texts
-        documents = SimpleDirectoryReader("./augustine_texts").load_data()
-        # Create new index
-        index = GPTVectorStoreIndex.from_documents(
-            documents,
-            embed_model=embed_model
-        )
-        # Save the index
-        index.storage_context.persist(persist_dir="./augustine_index")
-        print("New index built and saved")
-    return index
-
-# Initialize the index and query engine
-index = initialize_index()
-query_engine = index.as_query_engine(
-    response_mode="tree_summarize",
-    similarity_top_k=3,
-    llm=None
-)
-
-def get_context(query, author="Augustine"):
+        store = EmbeddingStore(store_dir)
+        print(f"Loaded embedding store with {len(store)} passages from {store_dir}")
+    except FileNotFoundError:
+        if store_dir != STORE_DIR or not allow_build:
+            raise FileNotFoundError(f"No embedding store in {store_dir}; run rebuild_index.py first")
+        from index_pipeline import build_store
+
+        print("Embedding store not found, building it...")
+        build_store(store_dir=STORE_DIR, model_name=EMBED_MODEL_NAME)
+        store = EmbeddingStore(STORE_DIR)
+    if store.model_name != EMBED_MODEL_NAME:
+        print(f"Warning: {store_dir} was embedded with {store.model_name}, queries use {EMBED_MODEL_NAME}")
+    return store
+
+def initialize_bm25(store_dir=STORE_DIR):
+    """
+    Open the BM25 index written next to the embedding store. Stores written
+    before it existed fall back to vector-only retrieval.
+    """
+    try:
+        return BM25Index(store_dir)
+    except FileNotFoundError:
+        print("BM25 index not found, using vector search only")
+        return None
+
+def load_shard(persona, store_dir):
+    """
+    Shard loader for the registry: the persona's store and the lexical index
+    of the same build. A build pruned while it is being opened (two rebuilds
+    landed meanwhile) is retried on the build CURRENT now names.
+    """
+    while True:
+        build = resolve_store(store_dir)
+        try:
+            store = initialize_store(store_dir)
+            bm25 = initialize_bm25(store.path)
+            if os.path.isdir(store.path):
+                return store, bm25
+        except FileNotFoundError:
+            if resolve_store(store_dir) == build:
+                raise
+        print(f"{build} was replaced while opening it, retrying")
+
+# Per-persona index shards, opened on first use
+shards = ShardRegistry(parse_shards(SHARDS, STORE_DIR), load_shard)
+
+def warm_up(allow_build=False):
+    """
+    Load the embedding model, run one query through it and open the default
+    persona's shard, so the first request does not pay for it.
+    """
+    if allow_build and not store_exists(STORE_DIR):
+        initialize_store(STORE_DIR, allow_build=True)
+    get_embed_model().get_query_embedding("warm up")
+    with shards.acquire(DEFAULT_PERSONA):
+        pass
+
+def hybrid_search(shard, query, query_embedding, top_k=SIMILARITY_TOP_K, lambda_mult=MMR_LAMBDA):
+    """
+    Fuse dense and BM25 rankings with reciprocal rank fusion, then pick the
+    final top_k from the fused pool with Maximal Marginal Relevance so
+    overlapping chunks of the same chapter do not crowd out other evidence.
+    """
+    lexical_hits = shard.bm25.search(query, top_k=max(CANDIDATE_K, LEXICAL_PREFILTER_K)) if shard.bm25 else []
+    candidates = None
+    if LEXICAL_PREFILTER_K and len(lexical_hits) >= CANDIDATE_K:
+        candidates = [i for i, _ in lexical_hits]
+    vector_hits = shard.store.search(query_embedding, top_k=CANDIDATE_K, candidates=candidates)
+    fused = reciprocal_rank_fusion(vector_hits, lexical_hits[:CANDIDATE_K])[:max(MMR_POOL_K, top_k)]
+    if lambda_mult >= 1.0 or len(fused) <= top_k:
+        return fused[:top_k]
+    rows = np.asarray([i for i, _ in fused], dtype=np.int64)
+    scores = np.asarray([score for _, score in fused], dtype=np.float32)
+    # Fused scores scaled to [0, 1] so they are comparable with cosine similarity
+    picks = mmr(scores / scores.max(), shard.store.embeddings[rows], top_k, lambda_mult)
+    return [fused[p] for p in picks]
+
+# Lower-case connecting words when turning file names into titles
+TITLE_SMALL_WORDS = {"a", "ad", "an", "and", "against", "by", "called", "de", "in", "of", "on", "or", "the", "to"}
+
+def describe_source(file_name):
+    """
+    Turn a corpus file name into (work title, book), e.g.
+    "city_of_god_BOOK_1.txt" -> ("City of God", "1").
+    """
+    stem = os.path.splitext(file_name)[0]
+    book = None
+    match = re.match(r"(.+?)_(?:BOOK_(\w+)|FULL_TEXT)$", stem)
+    if match:
+        stem, book = match.group(1), match.group(2)
+    words = re.split(r"[_\-\s]+", stem)
+    title = " ".join(
+        word if i and word.lower() in TITLE_SMALL_WORDS and word.islower() else word[:1].upper() + word[1:]
+        for i, word in enumerate(words) if word
+    )
+    return title, book
+
+def embed_query(shard, query):
+    """
+    Query embedding, cached per shard by normalised question.
+    """
+    question = normalize_question(query)
+    query_embedding = shard.cache.embeddings.get(question)
+    if query_embedding is None:
+        query_embedding = get_embed_model().get_query_embedding(query)
+        shard.cache.embeddings.put(question, query_embedding)
+    return query_embedding
+
+def retrieve(query, top_k=SIMILARITY_TOP_K, author=DEFAULT_PERSONA):
+    """
+    Retrieve the top passages for a query as structured objects with their
+    work, book and fused retrieval score. No response synthesis happens here.
+    The author (persona) selects the index shard.
+    """
+    with shards.acquire(author) as shard:
+        store, cache = shard.store, shard.cache
+        question = normalize_question(query)
+        hits = cache.results.get((question, top_k))
+        if hits is None:
+            with stage("embedding"):
+                query_embedding = embed_query(shard, query)
+            with stage("search"):
+                hits = hybrid_search(shard, query, query_embedding, top_k=top_k)
+            cache.results.put((question, top_k), hits)
+
+        passages = []
+        for i, score in hits:
+            metadata = store.metadata(i)
+            file_name = metadata.get("file_name", "")
+            work, book = describe_source(file_name)
+            passages.append(Passage(
+                text=store.text(i),
+                work=work,
+                book=book,
+                file_name=file_name,
+                score=score,
+                sources=metadata.get("sources", [file_name]),
+            ))
+    return passages
+
+def question_embedding(query, author=DEFAULT_PERSONA):
+    """
+    Query embedding through the persona shard's cache, for callers outside
+    retrieve() such as the answer cache.
+    """
+    with shards.acquire(author) as shard:
+        return embed_query(shard, query)
+
+def score_sentences(query, sentences, author=DEFAULT_PERSONA):
+    """
+    Cosine similarity of each sentence to the query, used to compress
+    retrieved passages to the prompt budget.
+    """
+    query_embedding = np.asarray(question_embedding(query, author), dtype=np.float32)
+    vectors = np.asarray(get_embed_model().get_text_embedding_batch(sentences), dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1) * max(float(np.linalg.norm(query_embedding)), 1e-12)
+    return vectors @ query_embedding / np.maximum(norms, 1e-12)
+
+def cache_stats():
+    """
+    Hit and miss counters of the retrieval caches, per loaded shard.
+    """
+    return {shard.persona: {"index_version": shard.store.version, **shard.cache.stats()}
+            for shard in shards.loaded()}
+
+def shard_stats():
+    """
+    Loaded shards, their mapped size and pins, and load/eviction counters.
+    """
+    return shards.stats()
+
+def get_context(query, author=DEFAULT_PERSONA):
     """
     Retrieve relevant context for a given query.
     """
     try:
-        response = query_engine.query(query)
-        context = str(response)
+        passages = retrieve(query, author=author)
+        context = "\n\n".join(passage.text for passage in passages)
         if not context.strip():
             return "I apologize, but I couldn't find relevant passages for this query."
         return context
@@ -55,6 +234,7 @@ def get_context(query, author="Augustine"):
 
 # Example usage (can be commented out in production)
 if __name__ == "__main__":
+    warm_up(allow_build=True)
     test_query = "What does Augustine say about grace?"
     response = get_context(test_query)
     print("\nTest Query:", test_query)
@@ -0,0 +1,227 @@
+# admission.py
+"""
+Admission control for LLM calls.
+
+Each provider (the local Ollama instance, the OpenAI account) gets a fixed
+number of concurrent slots. Requests beyond that wait in a bounded queue
+ordered by priority, so interactive chat is served before tweet generation;
+when the queue is full, or a request has waited too long, it is rejected
+right away with Overloaded instead of piling onto the provider.
+
+With LLM_SLOT_DIR set (multi-worker mode), the slots are box-wide: slot i is
+an flock on <dir>/<provider>.<i>.lock, so every server process sharing the
+directory draws from the same limit, and the OS frees the slots of a worker
+that dies. Each process still queues its own requests by priority and polls
+for a free slot while any are waiting.
+"""
+import asyncio
+import fcntl
+import heapq
+import itertools
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+import numpy as np
+
+# Lower runs first
+PRIORITY_CHAT = 0
+PRIORITY_ASK = 1
+PRIORITY_TWEET = 2
+PRIORITY_BACKGROUND = 3
+
+OLLAMA_CONCURRENCY = int(os.getenv("OLLAMA_CONCURRENCY", "2"))
+OPENAI_CONCURRENCY = int(os.getenv("OPENAI_CONCURRENCY", "8"))
+LLM_QUEUE_SIZE = int(os.getenv("LLM_QUEUE_SIZE", "32"))
+# Seconds a request may wait for a slot before it is turned away
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+RETRY_AFTER = 5
+# Recent waits kept for the percentiles in stats()
+WAIT_SAMPLES = 1000
+# Directory of the box-wide slot locks; empty keeps the slots per process
+LLM_SLOT_DIR = os.getenv("LLM_SLOT_DIR", "")
+# Seconds between attempts to take a box-wide slot for a queued request
+SLOT_POLL_INTERVAL = 0.01
+
+
+class Overloaded(Exception):
+    """The provider's queue is full or the wait timed out."""
+
+    def __init__(self, provider, reason, retry_after=RETRY_AFTER):
+        super().__init__(f"{provider} is overloaded: {reason}")
+        self.provider = provider
+        self.retry_after = retry_after
+
+
+class SlotPool:
+    """`limit` slots shared by every process that uses the same lock files."""
+
+    def __init__(self, directory, name, limit):
+        os.makedirs(directory, exist_ok=True)
+        self.paths = [os.path.join(directory, f"{name}.{i}.lock") for i in range(limit)]
+
+    def _try_lock(self, path):
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return fd
+        except BlockingIOError:
+            os.close(fd)
+            return None
+
+    def try_acquire(self):
+        """A held slot (an open, locked file descriptor), or None when all are taken."""
+        for path in self.paths:
+            fd = self._try_lock(path)
+            if fd is not None:
+                return fd
+        return None
+
+    def release(self, fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def in_use(self):
+        """Slots currently held by any process."""
+        held = 0
+        for path in self.paths:
+            fd = self._try_lock(path)
+            if fd is None:
+                held += 1
+            else:
+                self.release(fd)
+        return held
+
+
+class AdmissionController:
+    """Concurrency limit plus a bounded priority wait queue for one provider."""
+
+    def __init__(self, provider, limit, queue_size=LLM_QUEUE_SIZE, timeout=LLM_QUEUE_TIMEOUT,
+                 slot_dir=LLM_SLOT_DIR):
+        self.provider = provider
+        self.limit = limit
+        self.pool = SlotPool(slot_dir, provider, limit) if slot_dir else None
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._waiters = []
+        self._order = itertools.count()
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self._poller = None
+
+    def is_idle(self):
+        """True when no call, in this process or (box-wide) any other, holds a slot or waits for one."""
+        if self.active or self._waiters:
+            return False
+        return self.pool is None or self.pool.in_use() == 0
+
+    def is_full(self):
+        """True when a new request would be rejected immediately."""
+        if self.pool is None and self.active < self.limit:
+            return False
+        return len(self._waiters) >= self.queue_size
+
+    def _take(self):
+        """A free slot for this process (True, or a box-wide lock), or None."""
+        if self.pool is not None:
+            return self.pool.try_acquire()
+        return True if self.active < self.limit else None
+
+    async def _poll(self):
+        # Box-wide slots are freed by other processes without telling us
+        while self._waiters:
+            token = self._take()
+            if token is None:
+                await asyncio.sleep(SLOT_POLL_INTERVAL)
+                continue
+            self.active += 1
+            self._grant(token)
+        self._poller = None
+
+    def _grant(self, token):
+        """Hand a slot to the most urgent waiter, or give it back when none is left."""
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(token)
+                return
+        self._release(token)
+
+    async def _acquire(self, priority):
+        if not self._waiters:
+            token = self._take()
+            if token is not None:
+                self.active += 1
+                self._admit(0.0)
+                return token
+        if len(self._waiters) >= self.queue_size:
+            self.rejected += 1
+            raise Overloaded(self.provider, "queue full")
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._order), future)
+        heapq.heappush(self._waiters, entry)
+        if self.pool is not None and self._poller is None:
+            self._poller = asyncio.get_running_loop().create_task(self._poll())
+        start = time.perf_counter()
+        try:
+            token = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # Granted just as we gave up: hand the slot on
+                self._release(future.result())
+            else:
+                future.cancel()
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+            if isinstance(e, asyncio.TimeoutError):
+                self.timed_out += 1
+                raise Overloaded(self.provider, f"no slot within {self.timeout:g}s")
+            raise
+        self._admit(time.perf_counter() - start)
+        return token
+
+    def _admit(self, waited):
+        self.admitted += 1
+        self._waits.append(waited)
+
+    def _release(self, token):
+        if self.pool is not None:
+            # Box-wide slots go back to every process; the pollers compete for them
+            self.active -= 1
+            self.pool.release(token)
+            return
+        # Pass the slot straight to the most urgent waiter
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(token)
+                return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority=PRIORITY_CHAT):
+        token = await self._acquire(priority)
+        try:
+            yield
+        finally:
+            self._release(token)
+
+    def stats(self):
+        waits = np.asarray(self._waits, dtype=np.float64) * 1000.0
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "box_active": self.pool.in_use() if self.pool is not None else self.active,
+            "queued": len(self._waiters),
+            "queue_size": self.queue_size,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "wait_p50_ms": float(np.percentile(waits, 50)) if len(waits) else 0.0,
+            "wait_p95_ms": float(np.percentile(waits, 95)) if len(waits) else 0.0,
+            "wait_max_ms": float(waits.max()) if len(waits) else 0.0,
+        }
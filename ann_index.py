@@ -0,0 +1,105 @@
+# ann_index.py
+"""
+Inverted-file (IVF) approximate nearest-neighbour index over the embedding store.
+
+Rows are clustered with spherical k-means; each centroid owns the list of
+rows closest to it. A query scores the centroids, then scans only the rows
+of the `nprobe` best lists, so latency grows with nprobe * list size rather
+than with the whole corpus. Small stores skip the index and stay exact.
+"""
+import os
+
+import numpy as np
+
+from store_io import save_npy
+
+CENTROIDS_FILE = "ivf_centroids.npy"
+LIST_OFFSETS_FILE = "ivf_list_offsets.npy"
+LIST_IDS_FILE = "ivf_list_ids.npy"
+IVF_FILES = (CENTROIDS_FILE, LIST_OFFSETS_FILE, LIST_IDS_FILE)
+
+# Below this many passages a flat scan is fast enough and exact
+ANN_MIN_SIZE = int(os.getenv("RAG_ANN_MIN_SIZE", "50000"))
+# Lists scanned per query: higher is slower with better recall
+DEFAULT_NPROBE = int(os.getenv("RAG_ANN_NPROBE", "16"))
+KMEANS_ITERATIONS = 20
+# Training sample per centroid; k-means on every row is not needed
+TRAINING_POINTS_PER_LIST = 256
+ASSIGN_BATCH = 65536
+
+
+def _assign(matrix, centroids):
+    """Index of the most similar centroid for each row, in bounded batches."""
+    labels = np.empty(len(matrix), dtype=np.int32)
+    for start in range(0, len(matrix), ASSIGN_BATCH):
+        labels[start:start + ASSIGN_BATCH] = np.argmax(matrix[start:start + ASSIGN_BATCH] @ centroids.T, axis=1)
+    return labels
+
+
+def train_kmeans(matrix, n_lists, iterations=KMEANS_ITERATIONS, seed=0):
+    """Spherical k-means on unit-length rows; returns unit-length centroids."""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(matrix), n_lists * TRAINING_POINTS_PER_LIST)
+    sample = np.asarray(matrix[np.sort(rng.choice(len(matrix), sample_size, replace=False))], dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        labels = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        counts = np.bincount(labels, minlength=n_lists)
+        # Re-seed empty lists from random sample rows
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            sums[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = sums / norms
+    return centroids.astype(np.float32)
+
+
+def remove_ivf_index(store_dir):
+    for name in IVF_FILES:
+        path = os.path.join(store_dir, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def write_ivf_index(store_dir, matrix, n_lists=None, min_size=ANN_MIN_SIZE):
+    """
+    Cluster the (unit-length) embedding matrix and persist the inverted lists.
+    Returns the number of lists, or 0 when the store is too small for ANN.
+    """
+    if len(matrix) < max(min_size, 1):
+        remove_ivf_index(store_dir)
+        return 0
+    n_lists = n_lists or max(1, int(np.sqrt(len(matrix))))
+    print(f"Training IVF index with {n_lists} lists over {len(matrix)} passages...")
+    centroids = train_kmeans(matrix, n_lists)
+    labels = _assign(matrix, centroids)
+    order = np.argsort(labels, kind="stable").astype(np.int64)
+    offsets = np.zeros(n_lists + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(labels, minlength=n_lists))
+    save_npy(os.path.join(store_dir, CENTROIDS_FILE), centroids)
+    save_npy(os.path.join(store_dir, LIST_OFFSETS_FILE), offsets)
+    save_npy(os.path.join(store_dir, LIST_IDS_FILE), order)
+    return n_lists
+
+
+class IVFIndex:
+    """Read-only inverted lists; candidates() feeds EmbeddingStore.search."""
+
+    def __init__(self, store_dir, nprobe=DEFAULT_NPROBE):
+        self.nprobe = nprobe
+        self.centroids = np.load(os.path.join(store_dir, CENTROIDS_FILE), mmap_mode="r")
+        self.offsets = np.load(os.path.join(store_dir, LIST_OFFSETS_FILE), mmap_mode="r")
+        self.ids = np.load(os.path.join(store_dir, LIST_IDS_FILE), mmap_mode="r")
+
+    def __len__(self):
+        return len(self.centroids)
+
+    def candidates(self, query, nprobe=None):
+        """Row ids in the `nprobe` lists whose centroids best match the query."""
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        scores = self.centroids @ query
+        lists = np.argpartition(-scores, nprobe - 1)[:nprobe]
+        return np.concatenate([self.ids[self.offsets[l]:self.offsets[l + 1]] for l in lists])
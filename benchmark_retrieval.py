@@ -0,0 +1,183 @@
+# benchmark_retrieval.py
+"""
+Retrieval quality and latency benchmark.
+
+Runs the golden questions in benchmark_questions.json (each labeled with the
+work and book it should be answered from) through every retrieval path and
+prints a JSON report: recall@k and MRR per path, p50/p95/p99 latency, index
+and model load times and peak RSS. Save the output per commit and diff it to
+see whether an index, chunking or embedding change helped.
+
+Runs offline against the local store (build it first with
+`python rebuild_index.py --workers N`, or pass --build):
+
+    python benchmark_retrieval.py --output bench.json
+"""
+import os
+
+# Never reach out to the Hugging Face hub; the model must already be cached
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import RAG
+from embedding_store import STORE_DIR, store_exists
+from shard_registry import DEFAULT_PERSONA, ShardRegistry
+
+QUESTIONS_FILE = "benchmark_questions.json"
+RECALL_AT = (1, 3, 5, 10)
+PATHS = ("hybrid", "vector", "bm25", "get_context")
+
+
+def load_questions(path=QUESTIONS_FILE):
+    with open(path) as f:
+        return json.load(f)["questions"]
+
+
+def is_relevant(file_names, expected):
+    """A hit comes from the expected work (and book, when one is given)."""
+    for file_name in file_names:
+        work, book = RAG.describe_source(file_name)
+        if work.lower() != expected["work"].lower():
+            continue
+        if expected.get("book") is None or (book or "").lower() == str(expected["book"]).lower():
+            return True
+    return False
+
+
+def first_relevant_rank(ranked_sources, expected):
+    """1-based rank of the first relevant hit, or None."""
+    for rank, file_names in enumerate(ranked_sources, start=1):
+        if is_relevant(file_names, expected):
+            return rank
+    return None
+
+
+def percentiles(latencies):
+    values = np.asarray(latencies, dtype=np.float64) * 1000.0
+    if not len(values):
+        return {}
+    return {
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "mean_ms": float(values.mean()),
+    }
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def _sources(store, i):
+    metadata = store.metadata(i)
+    return metadata.get("sources") or [metadata.get("file_name", "")]
+
+
+def run_path(path, shard, question, top_k):
+    """Ranked source lists for one question on one retrieval path."""
+    if path == "hybrid":
+        return [p.sources for p in RAG.retrieve(question, top_k=top_k)]
+    if path == "vector":
+        embedding = RAG.get_embed_model().get_query_embedding(question)
+        return [_sources(shard.store, i) for i, _ in shard.store.search(embedding, top_k=top_k)]
+    if path == "bm25":
+        hits = shard.bm25.search(question, top_k=top_k) if shard.bm25 else []
+        return [_sources(shard.store, i) for i, _ in hits]
+    # get_context returns joined text only; its ranking is the hybrid one
+    RAG.get_context(question)
+    return None
+
+
+def benchmark(questions, paths=PATHS, top_k=max(RECALL_AT), repeat=1, cached=False):
+    report = {}
+    with RAG.shards.acquire(DEFAULT_PERSONA) as shard:
+        for path in paths:
+            latencies, ranks = [], []
+            for item in questions:
+                for _ in range(repeat):
+                    if not cached:
+                        shard.cache.embeddings.clear()
+                        shard.cache.results.clear()
+                    start = time.perf_counter()
+                    ranked = run_path(path, shard, item["question"], top_k)
+                    latencies.append(time.perf_counter() - start)
+                if ranked is not None:
+                    ranks.append(first_relevant_rank(ranked, item))
+            result = {"latency": percentiles(latencies), "queries": len(latencies)}
+            if ranks:
+                result["recall"] = {
+                    f"@{k}": sum(1 for r in ranks if r is not None and r <= k) / len(ranks) for k in RECALL_AT
+                }
+                result["mrr"] = sum(1.0 / r for r in ranks if r is not None) / len(ranks)
+                result["misses"] = [item["question"] for item, r in zip(questions, ranks) if r is None]
+            report[path] = result
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark retrieval quality and latency")
+    parser.add_argument("--questions", default=QUESTIONS_FILE, help="Golden question set (JSON)")
+    parser.add_argument("--store-dir", default=STORE_DIR, help="Embedding store to benchmark")
+    parser.add_argument("--paths", default=",".join(PATHS), help=f"Comma-separated subset of {', '.join(PATHS)}")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per question, for steadier latencies")
+    parser.add_argument("--cached", action="store_true", help="Keep the retrieval cache warm between runs")
+    parser.add_argument("--build", action="store_true", help="Build the store from augustine_texts if missing")
+    parser.add_argument("--output", default=None, help="Write the JSON report here as well as stdout")
+    args = parser.parse_args()
+
+    if not store_exists(args.store_dir):
+        if not args.build:
+            sys.exit(f"No embedding store in {args.store_dir}; run rebuild_index.py or pass --build")
+        from index_pipeline import build_store
+        build_store(store_dir=args.store_dir)
+    if args.store_dir != STORE_DIR:
+        RAG.shards = ShardRegistry({DEFAULT_PERSONA: args.store_dir}, RAG.load_shard)
+
+    start = time.perf_counter()
+    RAG.get_embed_model().get_query_embedding("warm up")
+    model_load = time.perf_counter() - start
+    start = time.perf_counter()
+    with RAG.shards.acquire(DEFAULT_PERSONA) as shard:
+        index_load = time.perf_counter() - start
+        manifest = dict(shard.store.manifest)
+
+    questions = load_questions(args.questions)
+    paths = [p.strip() for p in args.paths.split(",") if p.strip()]
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "questions": len(questions),
+        "store": {key: manifest.get(key) for key in ("model_name", "count", "dim", "ann_lists", "quantization", "version")},
+        "model_load_s": model_load,
+        "index_load_s": index_load,
+        "paths": benchmark(questions, paths, repeat=args.repeat, cached=args.cached),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# bm25_index.py
+"""
+Compact BM25 inverted index stored next to the embedding store.
+
+Postings are flat arrays: for term t, documents postings[offsets[t]:offsets[t+1]]
+with term frequencies tfs[...] in the same slice. All arrays are loaded with
+mmap, like the embedding matrix, so proper names and Latin titles
+("De Genesi ad litteram", "Pelagius") can be matched exactly at query time.
+"""
+import json
+import os
+import re
+from collections import Counter
+
+import numpy as np
+
+from store_io import save_json, save_npy
+
+TERMS_FILE = "bm25_terms.json"
+POSTINGS_FILE = "bm25_postings.npy"
+TFS_FILE = "bm25_tfs.npy"
+OFFSETS_FILE = "bm25_offsets.npy"
+DOC_LENGTHS_FILE = "bm25_doclens.npy"
+BM25_FILES = (TERMS_FILE, POSTINGS_FILE, TFS_FILE, OFFSETS_FILE, DOC_LENGTHS_FILE)
+
+K1 = 1.2
+B = 0.75
+RRF_K = 60
+
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from had has have he her his i in is it its "
+    "me my not of on or our so that the their them they this to was we were what "
+    "which who will with you your".split()
+)
+
+
+def tokenize(text):
+    return [token for token in re.findall(r"[a-z0-9]+", text.lower()) if token not in STOPWORDS]
+
+
+def write_bm25_index(store_dir, texts):
+    """Build the inverted index for the passages of a store, in row order."""
+    postings = {}
+    doc_lengths = np.zeros(len(texts), dtype=np.int32)
+    for doc_id, text in enumerate(texts):
+        counts = Counter(tokenize(text))
+        doc_lengths[doc_id] = sum(counts.values())
+        for term, tf in counts.items():
+            postings.setdefault(term, []).append((doc_id, tf))
+
+    terms = sorted(postings)
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    for i, term in enumerate(terms):
+        offsets[i + 1] = offsets[i] + len(postings[term])
+    doc_ids = np.empty(offsets[-1], dtype=np.int32)
+    tfs = np.empty(offsets[-1], dtype=np.uint16)
+    for i, term in enumerate(terms):
+        entries = np.asarray(postings[term], dtype=np.int64)
+        doc_ids[offsets[i]:offsets[i + 1]] = entries[:, 0]
+        tfs[offsets[i]:offsets[i + 1]] = np.minimum(entries[:, 1], np.iinfo(np.uint16).max)
+
+    save_npy(os.path.join(store_dir, POSTINGS_FILE), doc_ids)
+    save_npy(os.path.join(store_dir, TFS_FILE), tfs)
+    save_npy(os.path.join(store_dir, OFFSETS_FILE), offsets)
+    save_npy(os.path.join(store_dir, DOC_LENGTHS_FILE), doc_lengths)
+    save_json(os.path.join(store_dir, TERMS_FILE), terms, separators=(",", ":"))
+
+
+class BM25Index:
+    """Read-only BM25 index over the rows of an EmbeddingStore."""
+
+    def __init__(self, store_dir):
+        with open(os.path.join(store_dir, TERMS_FILE)) as f:
+            self.term_ids = {term: i for i, term in enumerate(json.load(f))}
+        self.postings = np.load(os.path.join(store_dir, POSTINGS_FILE), mmap_mode="r")
+        self.tfs = np.load(os.path.join(store_dir, TFS_FILE), mmap_mode="r")
+        self.offsets = np.load(os.path.join(store_dir, OFFSETS_FILE), mmap_mode="r")
+        self.doc_lengths = np.load(os.path.join(store_dir, DOC_LENGTHS_FILE), mmap_mode="r")
+        self.avg_length = float(self.doc_lengths.mean()) if len(self.doc_lengths) else 0.0
+        self._length_norm = None
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def _norm(self):
+        # K1 * (1 - B + B * dl / avgdl), computed once on first search
+        if self._length_norm is None:
+            avg = self.avg_length or 1.0
+            self._length_norm = (K1 * (1 - B + B * self.doc_lengths / avg)).astype(np.float32)
+        return self._length_norm
+
+    def search(self, query, top_k=10):
+        """Return (passage index, BM25 score) pairs, best first."""
+        term_ids = {self.term_ids[t] for t in tokenize(query) if t in self.term_ids}
+        if not term_ids or len(self) == 0:
+            return []
+        norm = self._norm()
+        scores = np.zeros(len(self), dtype=np.float32)
+        for term_id in term_ids:
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            docs = self.postings[start:end]
+            tf = self.tfs[start:end].astype(np.float32)
+            df = end - start
+            idf = np.log(1 + (len(self) - df + 0.5) / (df + 0.5))
+            scores[docs] += idf * tf * (K1 + 1) / (tf + norm[docs])
+        matched = np.flatnonzero(scores)
+        k = min(top_k, len(matched))
+        top = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top]
+
+
+def reciprocal_rank_fusion(*rankings, k=RRF_K):
+    """
+    Fuse ranked (passage index, score) lists: each list contributes
+    1 / (k + rank) per passage. Returns (passage index, fused score) pairs.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, (i, _) in enumerate(ranking):
+            fused[i] = fused.get(i, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,235 @@
+# caching.py
+"""
+In-process caches for the request path.
+
+TTLCache is a thread-safe LRU with per-entry expiry and hit/miss counters.
+RetrievalCache pairs two of them: query embeddings keyed by normalised
+question, and top-k passage IDs keyed by question and persona. Each shard
+has its own, and a shard reopened after its store was rebuilt starts with
+empty ones (see shard_registry). SemanticCache returns stored
+answers for paraphrased questions by embedding similarity. SingleFlight lets
+concurrent identical requests share one in-flight call instead of each
+starting it.
+"""
+import asyncio
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RAG_CACHE_SIZE", "1024"))
+RETRIEVAL_CACHE_TTL = float(os.getenv("RAG_CACHE_TTL", "3600"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+# Cosine similarity a cached question needs to answer a new one; above 1 disables the cache
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92"))
+
+
+def normalize_question(question):
+    """Lower-case, collapse whitespace and drop trailing punctuation."""
+    return re.sub(r"\s+", " ", question.lower()).strip().rstrip("?!. ")
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries expire `ttl` seconds after insertion."""
+
+    def __init__(self, maxsize=1024, ttl=3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class RetrievalCache:
+    """Query-embedding and retrieval-result caches of one opened shard."""
+
+    def __init__(self, maxsize=RETRIEVAL_CACHE_SIZE, ttl=RETRIEVAL_CACHE_TTL):
+        self.embeddings = TTLCache(maxsize, ttl)
+        self.results = TTLCache(maxsize, ttl)
+
+    def stats(self):
+        return {
+            "embeddings": self.embeddings.stats(),
+            "results": self.results.stats(),
+        }
+
+
+class _AnswerScope:
+    """Answers of one scope: a slot matrix of question vectors plus LRU order."""
+
+    def __init__(self, maxsize, dim):
+        self.vectors = np.zeros((maxsize, dim), dtype=np.float32)
+        self.live = np.zeros(maxsize, dtype=bool)
+        self.questions = [None] * maxsize
+        # question -> (slot, expires, answer), least recently used first
+        self.entries = OrderedDict()
+        self.free = list(range(maxsize - 1, -1, -1))
+
+    def drop(self, question):
+        slot = self.entries.pop(question)[0]
+        self.live[slot] = False
+        self.free.append(slot)
+
+
+class SemanticCache:
+    """
+    Answer cache keyed by question meaning. Each scope (e.g. endpoint,
+    persona and mode) holds at most `maxsize` unit-length question vectors;
+    a lookup is one matrix-vector product over them and hits when the best
+    cosine similarity reaches `threshold`. Entries expire after `ttl`
+    seconds and the least recently used are evicted first.
+    """
+
+    def __init__(self, maxsize=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL, threshold=ANSWER_CACHE_THRESHOLD):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self._scopes = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.maxsize > 0 and self.threshold <= 1.0
+
+    @staticmethod
+    def _unit(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def get(self, scope, embedding):
+        """The cached answer for the most similar question, or None."""
+        with self._lock:
+            entries = self._scopes.get(scope)
+            if entries is None or not entries.entries:
+                self.misses += 1
+                return None
+            scores = entries.vectors @ self._unit(embedding)
+            scores[~entries.live] = -np.inf
+            slot = int(np.argmax(scores))
+            if scores[slot] >= self.threshold:
+                question = entries.questions[slot]
+                _, expires, answer = entries.entries[question]
+                if expires > time.monotonic():
+                    entries.entries.move_to_end(question)
+                    self.hits += 1
+                    return answer
+                entries.drop(question)
+            self.misses += 1
+            return None
+
+    def put(self, scope, question, embedding, answer):
+        vector = self._unit(embedding)
+        question = normalize_question(question)
+        with self._lock:
+            entries = self._scopes.get(scope)
+            if entries is None:
+                entries = self._scopes[scope] = _AnswerScope(self.maxsize, len(vector))
+            if question in entries.entries:
+                entries.drop(question)
+            if not entries.free:
+                entries.drop(next(iter(entries.entries)))
+            slot = entries.free.pop()
+            entries.vectors[slot] = vector
+            entries.live[slot] = True
+            entries.questions[slot] = question
+            entries.entries[question] = (slot, time.monotonic() + self.ttl, answer)
+
+    def clear(self):
+        with self._lock:
+            self._scopes.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": sum(len(entries.entries) for entries in self._scopes.values()),
+            "scopes": len(self._scopes),
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent async calls with the same key into one in-flight
+    future. Keys are tuples whose first item names the kind of call, which
+    is what the counters are grouped by.
+    """
+
+    def __init__(self):
+        self._in_flight = {}
+        self.calls = {}
+        self.coalesced = {}
+
+    async def run(self, key, func, *args, **kwargs):
+        """Await func(*args, **kwargs), or the identical call already running."""
+        kind = key[0]
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced[kind] = self.coalesced.get(kind, 0) + 1
+        else:
+            self.calls[kind] = self.calls.get(kind, 0) + 1
+            future = asyncio.ensure_future(func(*args, **kwargs))
+            self._in_flight[key] = future
+            future.add_done_callback(lambda done: self._finish(key, done))
+        # One waiter being cancelled must not cancel the call for the others
+        return await asyncio.shield(future)
+
+    def _finish(self, key, future):
+        self._in_flight.pop(key, None)
+        # Mark the error retrieved even if every waiter was cancelled
+        if not future.cancelled():
+            future.exception()
+
+    def stats(self):
+        return {
+            kind: {
+                "calls": self.calls.get(kind, 0),
+                "coalesced": self.coalesced.get(kind, 0),
+                "in_flight": sum(1 for key in self._in_flight if key[0] == kind),
+            }
+            for kind in sorted(set(self.calls) | set(self.coalesced))
+        }
@@ -1,6 +1,5 @@
 // src/App.js
 import React, { useState, useEffect, useRef } from 'react';
-import axios from 'axios';
 import './App.css';
 
 function Message({ role, message, persona }) {
@@ -57,6 +56,24 @@ function ChatInput({ query, setQuery, onSubmit, loading }) {
   );
 }
 
+// Parse one Server-Sent Event block ("event: ...\ndata: ...") into { event, data }
+function parseEvent(block) {
+  let event = 'message';
+  const data = [];
+  for (const line of block.split('\n')) {
+    if (line.startsWith('event:')) event = line.slice(6).trim();
+    else if (line.startsWith('data:')) data.push(line.slice(5).trim());
+  }
+  return { event, data: data.length ? JSON.parse(data.join('\n')) : null };
+}
+
+// Tag the turn's local user and assistant messages with the IDs the server stored them under
+function withTurnIds(messages, turn) {
+  if (!turn) return messages;
+  const tail = messages.slice(-turn.length).map((msg, i) => ({ ...msg, id: turn[i].id }));
+  return [...messages.slice(0, -turn.length), ...tail];
+}
+
 function App() {
   const [query, setQuery] = useState('');
   const [messages, setMessages] = useState([]);
@@ -65,6 +82,7 @@ function App() {
   const [mode, setMode] = useState('conversation');
   const [sessionId, setSessionId] = useState(null);
   const [loading, setLoading] = useState(false);
+  const [streaming, setStreaming] = useState(false);
   const messagesEndRef = useRef(null);
 
   const scrollToBottom = () => {
@@ -75,21 +93,63 @@ function App() {
     scrollToBottom();
   }, [messages]);
 
+  // Append a token to the assistant message being streamed, starting it on the first token
+  const appendToken = (token, first) => {
+    setMessages(prev => {
+      if (first) return [...prev, { role: 'assistant', message: token }];
+      const last = prev[prev.length - 1];
+      return [...prev.slice(0, -1), { ...last, message: last.message + token }];
+    });
+  };
+
   const sendMessage = async (messageText) => {
     setLoading(true);
+    let started = false;
     try {
-      const res = await axios.post('/api/chat', {
-        question: messageText,
-        mode: mode,
-        persona: persona,
-        session_id: sessionId
+      const res = await fetch('/api/chat/stream', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+          question: messageText,
+          mode: mode,
+          persona: persona,
+          session_id: sessionId
+        })
       });
-
-      if (!sessionId && res.data.session_id) {
-        setSessionId(res.data.session_id);
+      if (!res.ok || !res.body) {
+        throw new Error(`Request failed with status ${res.status}`);
       }
 
-      setMessages(prev => [...prev, { role: 'assistant', message: res.data.response }]);
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const blocks = buffer.split('\n\n');
+        buffer = blocks.pop();
+        for (const block of blocks) {
+          const { event, data } = parseEvent(block);
+          if (event === 'session' && !sessionId && data.session_id) {
+            setSessionId(data.session_id);
+          } else if (event === 'token') {
+            appendToken(data.token, !started);
+            if (!started) {
+              started = true;
+              setStreaming(true);
+            }
+          } else if (event === 'done') {
+            // The server sends only the new turn; the transcript is kept locally
+            setMessages(prev => withTurnIds(
+              started ? prev : [...prev, { role: 'assistant', message: data.response }],
+              data.messages
+            ));
+          } else if (event === 'error') {
+            throw new Error(data.detail);
+          }
+        }
+      }
       return true;
     } catch (error) {
       console.error('Error fetching response:', error);
@@ -97,6 +157,7 @@ function App() {
       return false;
     } finally {
       setLoading(false);
+      setStreaming(false);
     }
   };
 
@@ -143,13 +204,13 @@ function App() {
         <div className="messages">
           {messages.map((msg, index) => (
             <Message 
-              key={index}
+              key={msg.id ? `m${msg.id}` : `local-${index}`}
               role={msg.role}
               message={msg.message}
               persona={persona}
             />
           ))}
-          {loading && (
+          {loading && !streaming && (
             <div className="message assistant-message">
               <span className="message-role">{persona}:</span>
               <p className="typing-indicator">Thinking...</p>
@@ -0,0 +1,141 @@
+# context_packer.py
+"""
+Token-budgeted prompt context.
+
+The chat prompt is built from recent history and retrieved passages. Both
+are packed into a fixed token budget: history takes up to its share (newest
+messages first) and whatever it leaves goes to the passages, which are
+compressed extractively by keeping their sentences most similar to the
+question, in original order.
+"""
+import os
+import re
+
+import numpy as np
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Tokens for history + passages; the Ollama context window is 4096 and up to
+# 1000 tokens are reserved for the answer
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2000"))
+HISTORY_SHARE = float(os.getenv("CONTEXT_HISTORY_SHARE", "0.3"))
+HISTORY_MAX_MESSAGES = 10
+# Model whose tokenizer is used for counting (the chat path goes to OpenAI)
+TOKENIZER_MODEL = os.getenv("CONTEXT_TOKENIZER_MODEL", "gpt-3.5-turbo")
+# Tokens for the "[n] Work, Book N" header of each passage
+CITATION_OVERHEAD = 12
+
+_encoding = None
+
+
+def approximate_tokens(text):
+    """About four characters per token for English prose."""
+    return (len(text) + 3) // 4
+
+
+def count_tokens(text):
+    """Count tokens with tiktoken when available, else approximate."""
+    global _encoding
+    if _encoding is None:
+        _encoding = False
+        if tiktoken is not None:
+            try:
+                _encoding = tiktoken.encoding_for_model(TOKENIZER_MODEL)
+            except Exception as e:
+                print(f"Falling back to approximate token counts: {str(e)}")
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return approximate_tokens(text)
+
+
+def split_sentences(text):
+    return [s for s in (part.strip() for part in re.split(r"(?<=[.!?;:])\s+", text)) if s]
+
+
+def lexical_scores(question, sentences):
+    """Fallback scorer: share of question words found in each sentence."""
+    words = set(re.findall(r"[a-z]+", question.lower()))
+    if not words:
+        return np.zeros(len(sentences), dtype=np.float32)
+    return np.asarray(
+        [len(words & set(re.findall(r"[a-z]+", s.lower()))) / len(words) for s in sentences],
+        dtype=np.float32,
+    )
+
+
+def pack_history(messages, budget, counter=count_tokens, persona="Augustine"):
+    """
+    Keep the most recent messages that fit the budget, oldest first. A single
+    message larger than the whole budget is cut to fit.
+    """
+    kept, used = [], 0
+    for message in reversed(messages[-HISTORY_MAX_MESSAGES:]):
+        line = format_history_line(message, persona)
+        tokens = counter(line) + 1
+        if used + tokens > budget:
+            if not kept and budget > 0:
+                # Characters per token of this line, to cut it roughly to size
+                ratio = len(line) / max(1, tokens)
+                kept.append(dict(message, message=message["message"][:int(budget * ratio)]))
+            break
+        kept.append(message)
+        used += tokens
+    return list(reversed(kept))
+
+
+def format_history_line(message, persona="Augustine"):
+    return f"{'Human' if message['role'] == 'user' else persona}: {message['message']}"
+
+
+def compress_passages(question, passages, budget, scorer=None, counter=count_tokens):
+    """
+    Keep the sentences of the passages most similar to the question until the
+    budget is spent. `scorer(question, sentences)` returns one similarity per
+    sentence; passages keep their original sentence order.
+    """
+    if not passages or budget <= 0:
+        return []
+    sentences = [(p, s) for p, passage in enumerate(passages) for s in split_sentences(passage.text)]
+    if not sentences:
+        return []
+    texts = [s for _, s in sentences]
+    try:
+        scores = np.asarray(scorer(question, texts) if scorer else lexical_scores(question, texts))
+    except Exception as e:
+        print(f"Sentence scoring failed, using lexical overlap: {str(e)}")
+        scores = lexical_scores(question, texts)
+    # Earlier passages rank higher; break score ties in their favour
+    order = np.lexsort((np.asarray([p for p, _ in sentences]), -scores))
+
+    chosen, used, opened = set(), 0, set()
+    for i in order:
+        p = sentences[i][0]
+        cost = counter(texts[i]) + 1 + (0 if p in opened else CITATION_OVERHEAD)
+        if used + cost > budget:
+            continue
+        chosen.add(int(i))
+        opened.add(p)
+        used += cost
+
+    compressed = []
+    for p, passage in enumerate(passages):
+        kept = [texts[i] for i in range(len(sentences)) if i in chosen and sentences[i][0] == p]
+        if kept:
+            compressed.append(passage.model_copy(update={"text": " ".join(kept)}))
+    return compressed
+
+
+def pack_context(question, history, passages, budget=CONTEXT_TOKEN_BUDGET,
+                 history_share=HISTORY_SHARE, scorer=None, counter=count_tokens, persona="Augustine"):
+    """
+    Split the budget between history and passages. Returns the kept history
+    messages and the compressed passages.
+    """
+    history_budget = int(budget * history_share) if passages else budget
+    kept_history = pack_history(history or [], history_budget, counter, persona)
+    history_tokens = sum(counter(format_history_line(m, persona)) + 1 for m in kept_history)
+    kept_passages = compress_passages(question, passages, budget - history_tokens, scorer, counter)
+    return kept_history, kept_passages
@@ -0,0 +1,237 @@
+# corpus_dedup.py
+"""
+Ingest-time clean-up of the corpus before chunking.
+
+The scraper saves both <work>_FULL_TEXT.txt and <work>_BOOK_*.txt for the same
+work, and the Gutenberg volumes repeat the New Advent books, so the same
+passages would otherwise be embedded and retrieved several times.
+
+strip_boilerplate removes Project Gutenberg license headers/footers and the
+New Advent source/contact/support footer lines. Deduplicator drops paragraphs
+already seen in another file, exactly (normalised hash) or nearly (MinHash
+over word shingles with LSH banding), and records the file it came from as an
+extra source of the chunks holding the canonical copy.
+"""
+import bisect
+import hashlib
+import re
+import zlib
+
+import numpy as np
+
+GUTENBERG_START = re.compile(r"^\*\*\* ?START OF (THE|THIS) PROJECT GUTENBERG.*$", re.M | re.I)
+GUTENBERG_END = re.compile(r"^\*\*\* ?END OF (THE|THIS) PROJECT GUTENBERG.*$", re.M | re.I)
+FOOTER_PREFIXES = (
+    "Source. Translated by",
+    "Contact information. The editor of New Advent",
+    "Please help support the mission of New Advent",
+)
+
+SHINGLE_SIZE = 5
+NUM_PERM = 32
+BANDS = 8
+NEAR_DUPLICATE_THRESHOLD = 0.8
+# Headings and short lines ("Book I", "Chapter 3.") are never deduplicated
+MIN_WORDS = 8
+# Blank-line blocks longer than this are runs of paragraphs, not one paragraph
+PARAGRAPH_MAX_CHARS = 4000
+# Share of the text that must sit in paragraph-sized blocks to split on blank lines
+BLANK_LINE_SHARE = 0.5
+BLANK_LINE = re.compile(r"\n[ \t]*\n")
+
+_PRIME = (1 << 31) - 1
+_rng = np.random.default_rng(20240601)
+_PERM_A = _rng.integers(1, _PRIME, NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.integers(0, _PRIME, NUM_PERM, dtype=np.uint64)
+
+
+def strip_boilerplate(text):
+    """
+    Normalise line endings (the Gutenberg volumes use CRLF), then remove the
+    Gutenberg license header/footer and New Advent footer lines.
+    """
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    start = GUTENBERG_START.search(text)
+    if start:
+        text = text[start.end():]
+    end = GUTENBERG_END.search(text)
+    if end:
+        text = text[:end.start()]
+    lines = [line for line in text.split("\n") if not line.lstrip().startswith(FOOTER_PREFIXES)]
+    return "\n".join(lines).strip()
+
+
+def source_priority(file_name):
+    """
+    Sort key deciding which copy of a passage is canonical: BOOK files carry
+    the most precise citation, whole-work FULL_TEXT files the least.
+    """
+    if "_BOOK_" in file_name:
+        rank = 0
+    elif "FULL_TEXT" in file_name:
+        rank = 2
+    else:
+        rank = 1
+    return rank, file_name
+
+
+def split_paragraphs(text):
+    """
+    Split on blank lines when most of the text is in paragraph-sized
+    blank-line blocks (hard-wrapped Gutenberg text), otherwise one paragraph
+    per line (New Advent, where a few blank lines only set off verse).
+    Returns the paragraphs and the separator that joins them back together.
+    """
+    blocks = BLANK_LINE.split(text)
+    if len(blocks) > 1:
+        paragraph_chars = sum(len(block) for block in blocks if len(block) <= PARAGRAPH_MAX_CHARS)
+        if paragraph_chars >= BLANK_LINE_SHARE * sum(len(block) for block in blocks):
+            return blocks, "\n\n"
+    return text.split("\n"), "\n"
+
+
+def _words(paragraph):
+    return re.findall(r"[a-z]+", paragraph.lower())
+
+
+def minhash(words):
+    """MinHash signature of the word shingles of a paragraph."""
+    shingles = [" ".join(words[i:i + SHINGLE_SIZE]) for i in range(max(1, len(words) - SHINGLE_SIZE + 1))]
+    hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+    values = (np.outer(hashes % _PRIME, _PERM_A) + _PERM_B) % _PRIME
+    return values.min(axis=0).astype(np.uint32)
+
+
+class _Paragraph:
+    """A canonical paragraph, the chunks that contain it and every file it appears in."""
+
+    __slots__ = ("signature", "sources", "refs")
+
+    def __init__(self, signature, sources):
+        self.signature = signature
+        self.sources = set(sources)
+        self.refs = []
+
+    def add_source(self, file_name):
+        if file_name in self.sources:
+            return
+        self.sources.add(file_name)
+        for metadata in self.refs:
+            if file_name not in metadata["sources"]:
+                metadata["sources"].append(file_name)
+
+    def add_ref(self, metadata):
+        self.refs.append(metadata)
+        for file_name in sorted(self.sources):
+            if file_name not in metadata["sources"]:
+                metadata["sources"].append(file_name)
+
+
+class _Spans(list):
+    """(start, end, paragraph) spans of one file, sorted by start."""
+
+    def __init__(self, spans):
+        super().__init__(spans)
+        self.ends = [span[1] for span in spans]
+
+
+class Deduplicator:
+    """Drops repeated paragraphs across the files of one build."""
+
+    def __init__(self, threshold=NEAR_DUPLICATE_THRESHOLD):
+        self.threshold = threshold
+        self.exact = {}
+        self.buckets = {}
+        self.kept = 0
+        self.dropped = 0
+
+    def _bands(self, signature):
+        rows = NUM_PERM // BANDS
+        return [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(BANDS)]
+
+    def _lookup(self, key, signature):
+        paragraph = self.exact.get(key)
+        if paragraph is not None:
+            return paragraph
+        for band in self._bands(signature):
+            for candidate in self.buckets.get(band, ()):
+                if np.mean(candidate.signature == signature) >= self.threshold:
+                    return candidate
+        return None
+
+    def _register(self, key, signature, sources):
+        paragraph = _Paragraph(signature, sources)
+        self.exact[key] = paragraph
+        for band in self._bands(signature):
+            self.buckets.setdefault(band, []).append(paragraph)
+        return paragraph
+
+    def dedup_text(self, file_name, text):
+        """
+        Drop paragraphs of `text` already seen in other files.
+
+        Returns the remaining text and a sorted list of (start, end, paragraph)
+        spans used by attach() to link chunks to their canonical paragraphs.
+        """
+        paragraphs, separator = split_paragraphs(text)
+        kept, spans, offset = [], [], 0
+        for raw in paragraphs:
+            words = _words(raw)
+            paragraph = None
+            if len(words) >= MIN_WORDS:
+                key = hashlib.sha1(" ".join(words).encode("utf-8")).digest()
+                signature = minhash(words)
+                paragraph = self._lookup(key, signature)
+                if paragraph is not None and file_name not in paragraph.sources:
+                    paragraph.add_source(file_name)
+                    self.dropped += 1
+                    continue
+                if paragraph is None:
+                    paragraph = self._register(key, signature, [file_name])
+            self.kept += 1
+            if paragraph is not None:
+                spans.append((offset, offset + len(raw), paragraph))
+            kept.append(raw)
+            offset += len(raw) + len(separator)
+        return separator.join(kept), _Spans(spans)
+
+    def attach(self, metadata, start, end, spans):
+        """Link a chunk covering text[start:end] to the canonical paragraphs inside it."""
+        metadata.setdefault("sources", [metadata.get("file_name")])
+        if start is None or end is None:
+            return
+        i = bisect.bisect_right(spans.ends, start)
+        while i < len(spans) and spans[i][0] < end:
+            spans[i][2].add_ref(metadata)
+            i += 1
+
+    def seed(self, text, metadata):
+        """Register the paragraphs of an already indexed chunk (incremental builds)."""
+        paragraphs, _ = split_paragraphs(text)
+        for raw in paragraphs:
+            words = _words(raw)
+            if len(words) < MIN_WORDS:
+                continue
+            key = hashlib.sha1(" ".join(words).encode("utf-8")).digest()
+            signature = minhash(words)
+            paragraph = self._lookup(key, signature)
+            if paragraph is None:
+                paragraph = self._register(key, signature, metadata["sources"])
+            paragraph.refs.append(metadata)
+
+    def holders(self, text):
+        """Files whose chunks hold the registered copy of a paragraph of `text`."""
+        files = set()
+        for raw in split_paragraphs(text)[0]:
+            words = _words(raw)
+            if len(words) < MIN_WORDS:
+                continue
+            key = hashlib.sha1(" ".join(words).encode("utf-8")).digest()
+            paragraph = self._lookup(key, minhash(words))
+            if paragraph is not None:
+                files.update(metadata.get("file_name") for metadata in paragraph.refs)
+        return files
+
+    def report(self):
+        total = self.kept + self.dropped
+        print(f"De-duplication kept {self.kept} of {total} paragraphs ({self.dropped} duplicates dropped)")
@@ -40,11 +40,22 @@ def setup_database():
                 session_id VARCHAR(64),
                 role ENUM('user', 'assistant'),
                 message TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                INDEX session_id_idx (session_id, id)
             )
             """
             cursor.execute(create_table_query)
             print("Table 'chat_ui_history' created or already exists.")
+
+            # History is paged by (session_id, id); add the index to older tables
+            cursor.execute(
+                "SELECT COUNT(*) FROM information_schema.statistics "
+                "WHERE table_schema = %s AND table_name = 'chat_ui_history' AND index_name = 'session_id_idx'",
+                (MYSQL_DB,)
+            )
+            if cursor.fetchone()[0] == 0:
+                cursor.execute("ALTER TABLE chat_ui_history ADD INDEX session_id_idx (session_id, id)")
+                print("Index 'session_id_idx' added to 'chat_ui_history'.")
             
             # Create chat_sessions table
             create_sessions_table_query = """
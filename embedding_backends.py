@@ -0,0 +1,304 @@
+# embedding_backends.py
+"""
+Selectable CPU inference backends for the MiniLM embedding model.
+
+    torch      HuggingFaceEmbedding on PyTorch (the reference)
+    int8       the same SentenceTransformer with its Linear layers
+               dynamically quantized to int8
+    onnx       the transformer exported once to ONNX and run with onnxruntime
+    onnx-int8  the ONNX graph with dynamically quantized int8 weights
+
+All backends mean-pool and L2-normalise like the sentence-transformers
+pipeline, and expose the get_query_embedding / get_text_embedding_batch
+methods the rest of the code uses. Batches are sorted by length so padding
+stays small. RAG_EMBED_THREADS caps the intra-op threads of each process.
+
+Run `python embedding_backends.py [backend]` to check cosine parity against
+PyTorch and compare throughput. The result is recorded next to the ONNX
+graphs, and only backends with a passing check for the model can be loaded.
+"""
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+EMBED_BACKEND = os.getenv("RAG_EMBED_BACKEND", "torch")
+BACKENDS = ("torch", "int8", "onnx", "onnx-int8")
+# 0 leaves the runtime default (all cores)
+EMBED_THREADS = int(os.getenv("RAG_EMBED_THREADS", "0"))
+ONNX_DIR = os.getenv("RAG_ONNX_DIR", "./onnx_models")
+ENCODE_BATCH_SIZE = 32
+# all-MiniLM-L6-v2 truncates at 256 word pieces; exports record the model's own limit
+MAX_LENGTH = 256
+EXPORT_FILE = "export.json"
+PARITY_FILE = "parity.json"
+
+# Minimum cosine similarity to the PyTorch embedding of the same text
+PARITY_TOLERANCE = {"torch": 0.9999, "int8": 0.98, "onnx": 0.9999, "onnx-int8": 0.98}
+
+_export_lock = threading.Lock()
+
+
+def model_dir(model_name, onnx_dir=ONNX_DIR):
+    return os.path.join(onnx_dir, model_name.replace("/", "__"))
+
+
+def onnx_path(model_name, quantized=False, onnx_dir=ONNX_DIR):
+    return os.path.join(model_dir(model_name, onnx_dir), "model_int8.onnx" if quantized else "model.onnx")
+
+
+def _read_json(path, default):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+
+def parity_results(model_name, onnx_dir=ONNX_DIR):
+    """Last parity check of each backend for `model_name`, keyed by backend."""
+    return _read_json(os.path.join(model_dir(model_name, onnx_dir), PARITY_FILE), {})
+
+
+def record_parity(model_name, results, onnx_dir=ONNX_DIR):
+    from store_io import save_json
+
+    recorded = parity_results(model_name, onnx_dir)
+    recorded.update({result["backend"]: result for result in results})
+    os.makedirs(model_dir(model_name, onnx_dir), exist_ok=True)
+    save_json(os.path.join(model_dir(model_name, onnx_dir), PARITY_FILE), recorded, indent=2)
+
+
+def require_parity(model_name, backend, onnx_dir=ONNX_DIR):
+    """Refuse a non-reference backend until its parity check has passed for the model."""
+    if backend == "torch":
+        return
+    if not parity_results(model_name, onnx_dir).get(backend, {}).get("passed"):
+        raise ValueError(
+            f"Embedding backend {backend!r} has no passing parity check for {model_name}; "
+            f"run `python embedding_backends.py {backend}` first, or use RAG_EMBED_BACKEND=torch"
+        )
+
+
+def export_onnx(model_name, quantized=False, onnx_dir=ONNX_DIR):
+    """
+    Export the transformer to ONNX (and quantize it) once; later calls reuse
+    the files. Returns the path of the requested graph.
+    """
+    path = onnx_path(model_name, quantized, onnx_dir)
+    with _export_lock:
+        if os.path.exists(path):
+            return path
+        base = onnx_path(model_name, False, onnx_dir)
+        if not os.path.exists(base):
+            import torch
+            from sentence_transformers import SentenceTransformer
+
+            from store_io import save_json
+
+            print(f"Exporting {model_name} to {base}...")
+            os.makedirs(os.path.dirname(base), exist_ok=True)
+            # The transformer and truncation length of the PyTorch reference
+            reference = SentenceTransformer(model_name, device="cpu")
+            model = reference[0].auto_model.eval()
+            sample = reference.tokenizer(["warm up"], return_tensors="pt")
+            # Positional order of BertModel.forward
+            names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+            axes = {name: {0: "batch", 1: "sequence"} for name in names}
+            axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+            # Exporters may save weights beside the graph, named after it
+            tmp_dir = f"{base}.tmp"
+            os.makedirs(tmp_dir, exist_ok=True)
+            with torch.no_grad():
+                torch.onnx.export(
+                    model, tuple(sample[name] for name in names), os.path.join(tmp_dir, "model.onnx"),
+                    input_names=names, output_names=["last_hidden_state"],
+                    dynamic_axes=axes, opset_version=17,
+                )
+            save_json(os.path.join(os.path.dirname(base), EXPORT_FILE),
+                      {"max_seq_length": reference.max_seq_length})
+            # The graph goes last, so it never appears without its weights
+            for name in sorted(os.listdir(tmp_dir), key=lambda name: name == "model.onnx"):
+                os.replace(os.path.join(tmp_dir, name), os.path.join(os.path.dirname(base), name))
+            os.rmdir(tmp_dir)
+        if quantized:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            print(f"Quantizing {base} to int8...")
+            quantize_dynamic(base, f"{path}.tmp", weight_type=QuantType.QInt8)
+            os.replace(f"{path}.tmp", path)
+    return path
+
+
+def _length_batches(texts, batch_size):
+    """Index batches of similar-length texts, to keep padding small."""
+    order = np.argsort([len(text) for text in texts], kind="stable")
+    return [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+
+
+class _Embedder:
+    """Drop-in for the HuggingFaceEmbedding methods used by retrieval and builds."""
+
+    backend = None
+
+    def __init__(self, model_name, batch_size=ENCODE_BATCH_SIZE):
+        self.model_name = model_name
+        self.batch_size = batch_size
+
+    def encode(self, texts):
+        """(len(texts), dim) float32 unit-length embeddings."""
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        out = None
+        for rows in _length_batches(texts, self.batch_size):
+            vectors = self._encode_batch([texts[i] for i in rows])
+            if out is None:
+                out = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+            out[rows] = vectors
+        return out
+
+    def get_query_embedding(self, query):
+        return self.encode([query])[0].tolist()
+
+    def get_text_embedding(self, text):
+        return self.encode([text])[0].tolist()
+
+    def get_text_embedding_batch(self, texts, **kwargs):
+        return self.encode(texts).tolist()
+
+
+class QuantizedTorchEmbedder(_Embedder):
+    """SentenceTransformer with int8 dynamically quantized Linear layers."""
+
+    backend = "int8"
+
+    def __init__(self, model_name, batch_size=ENCODE_BATCH_SIZE):
+        super().__init__(model_name, batch_size)
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        model = SentenceTransformer(model_name, device="cpu").eval()
+        self.model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    def _encode_batch(self, texts):
+        return self.model.encode(texts, batch_size=len(texts), normalize_embeddings=True,
+                                 convert_to_numpy=True).astype(np.float32)
+
+
+class OnnxEmbedder(_Embedder):
+    """Exported transformer on onnxruntime with mean pooling."""
+
+    def __init__(self, model_name, quantized=False, threads=EMBED_THREADS, batch_size=ENCODE_BATCH_SIZE):
+        super().__init__(model_name, batch_size)
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        self.backend = "onnx-int8" if quantized else "onnx"
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+        options.inter_op_num_threads = 1
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(
+            export_onnx(model_name, quantized), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        export = _read_json(os.path.join(model_dir(model_name), EXPORT_FILE), {})
+        self.max_length = export.get("max_seq_length", MAX_LENGTH)
+
+    def _encode_batch(self, texts):
+        encoded = self.tokenizer(texts, padding=True, truncation=True, max_length=self.max_length,
+                                 return_tensors="np")
+        feeds = {name: encoded[name].astype(np.int64) for name in self.input_names}
+        hidden = self.session.run(None, feeds)[0]
+        mask = encoded["attention_mask"][..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return (pooled / np.maximum(norms, 1e-12)).astype(np.float32)
+
+
+def prepare_backend(model_name, backend=EMBED_BACKEND):
+    """Export ONNX graphs up front, so worker processes only load them."""
+    require_parity(model_name, backend)
+    if backend in ("onnx", "onnx-int8"):
+        export_onnx(model_name, quantized=backend == "onnx-int8")
+
+
+def load_embed_model(model_name, backend=EMBED_BACKEND, threads=EMBED_THREADS):
+    """
+    Embedding model for the selected backend, capped to `threads` cores.
+    Raises ValueError for backends without a passing parity check.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend {backend!r}; use one of {', '.join(BACKENDS)}")
+    require_parity(model_name, backend)
+    return _load(model_name, backend, threads)
+
+
+def _load(model_name, backend, threads):
+    if backend in ("torch", "int8") and threads:
+        import torch
+        torch.set_num_threads(threads)
+    if backend == "torch":
+        from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+        return HuggingFaceEmbedding(model_name=model_name)
+    if backend == "int8":
+        return QuantizedTorchEmbedder(model_name)
+    return OnnxEmbedder(model_name, quantized=backend == "onnx-int8", threads=threads)
+
+
+def _timed_embeddings(model, texts):
+    start = time.perf_counter()
+    vectors = np.asarray(model.get_text_embedding_batch(texts), dtype=np.float32)
+    return vectors, time.perf_counter() - start
+
+
+def parity_check(model_name, backend, texts, threads=EMBED_THREADS):
+    """
+    Cosine similarity of `backend` embeddings to the PyTorch reference, and
+    the throughput of both. `passed` is False below PARITY_TOLERANCE.
+    """
+    reference, reference_s = _timed_embeddings(_load(model_name, "torch", threads), texts)
+    candidate, candidate_s = _timed_embeddings(_load(model_name, backend, threads), texts)
+    reference /= np.linalg.norm(reference, axis=1, keepdims=True)
+    candidate /= np.linalg.norm(candidate, axis=1, keepdims=True)
+    cosines = (reference * candidate).sum(axis=1)
+    return {
+        "backend": backend,
+        "texts": len(texts),
+        "min_cosine": float(cosines.min()),
+        "mean_cosine": float(cosines.mean()),
+        "torch_texts_per_s": len(texts) / reference_s,
+        "backend_texts_per_s": len(texts) / candidate_s,
+        "passed": bool(cosines.min() >= PARITY_TOLERANCE[backend]),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from index_pipeline import EMBED_MODEL_NAME, TEXTS_DIR, list_source_files
+
+    parser = argparse.ArgumentParser(description="Check embedding backends against PyTorch")
+    parser.add_argument("backends", nargs="*", help=f"Any of {', '.join(BACKENDS[1:])} (default: all)")
+    parser.add_argument("--model", default=EMBED_MODEL_NAME, help="Model name or local path")
+    args = parser.parse_args()
+    for backend in args.backends:
+        if backend not in BACKENDS[1:]:
+            parser.error(f"unknown backend {backend!r}")
+    # Paragraphs from the corpus, short and long, as sample inputs
+    texts = []
+    for name in list_source_files(TEXTS_DIR)[:20]:
+        with open(os.path.join(TEXTS_DIR, name), errors="ignore") as f:
+            texts.extend(p.strip() for p in f.read().split("\n\n") if len(p.split()) >= 5)
+    texts = texts[:256] + ["What does Augustine say about grace?", "Why did you steal the pears?"]
+    results = [parity_check(args.model, backend, texts) for backend in args.backends or BACKENDS[1:]]
+    record_parity(args.model, results)
+    print(json.dumps(results, indent=2))
+    sys.exit(0 if all(result["passed"] for result in results) else 1)
@@ -0,0 +1,295 @@
+# embedding_store.py
+"""
+Memory-mapped embedding store for the RAG index.
+
+The store is a directory holding:
+  embeddings.npy  - contiguous float32 matrix (one L2-normalised row per passage)
+  offsets.npy     - int64 table of (text_start, text_len, meta_start, meta_len)
+  passages.bin    - UTF-8 passage text, concatenated
+  metadata.bin    - compact JSON metadata per passage, concatenated
+  bm25_*          - BM25 inverted index over the same rows (see bm25_index)
+  ivf_*           - optional IVF approximate index for large stores (see ann_index)
+  embeddings_f16/int8 - optional quantized copy scanned first (see quantization)
+  store.json      - manifest (model name, dimensions, count, version)
+
+Each build writes these files into a new v-<version> directory under the
+store directory, then swaps the one-line CURRENT pointer to it, so a reader
+always opens one complete build. The previous build is kept for readers
+still opening it; older ones are removed. Stores written before versioned
+directories hold the files directly in the store directory.
+
+Everything is opened read-only with mmap, so loading is nearly instant and
+several uvicorn workers share the same pages through the OS cache.
+"""
+import json
+import mmap
+import os
+import shutil
+import uuid
+
+import numpy as np
+
+from ann_index import DEFAULT_NPROBE, IVF_FILES, IVFIndex, write_ivf_index
+from bm25_index import BM25_FILES, write_bm25_index
+from quantization import QUANTIZATION, QUANTIZED_FILES, QuantizedMatrix, shortlist_size, write_quantized
+from store_io import replace_file, save_json, save_npy
+
+STORE_DIR = "./augustine_store"
+FORMAT_VERSION = 1
+
+EMBEDDINGS_FILE = "embeddings.npy"
+OFFSETS_FILE = "offsets.npy"
+PASSAGES_FILE = "passages.bin"
+METADATA_FILE = "metadata.bin"
+MANIFEST_FILE = "store.json"
+# Names the live v-<version> directory of a versioned store
+CURRENT_FILE = "CURRENT"
+VERSION_PREFIX = "v-"
+# Builds kept besides the live one, for readers that resolved CURRENT just before a switch
+KEEP_VERSIONS = 1
+STORE_FILES = (EMBEDDINGS_FILE, OFFSETS_FILE, PASSAGES_FILE, METADATA_FILE, MANIFEST_FILE,
+               *BM25_FILES, *IVF_FILES, *(name for names in QUANTIZED_FILES.values() for name in names))
+# Written by index_pipeline.build_store for incremental rebuilds
+INDEX_MANIFEST_FILE = "index_manifest.json"
+
+# Only these metadata keys are kept; the rest of the reader metadata
+# (sizes, dates, absolute paths) is never used at query time.
+KEPT_METADATA = ("file_name", "chunk_id", "sources")
+
+
+def _normalize(matrix):
+    """Scale rows to unit length so a dot product is a cosine similarity."""
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _compact_metadata(metadata):
+    return {key: metadata[key] for key in KEPT_METADATA if key in metadata}
+
+
+def resolve_store(store_dir):
+    """Directory holding the live store files: the build CURRENT names, or store_dir itself."""
+    try:
+        with open(os.path.join(store_dir, CURRENT_FILE)) as f:
+            return os.path.join(store_dir, f.read().strip())
+    except FileNotFoundError:
+        return store_dir
+
+
+def store_exists(store_dir):
+    return os.path.isfile(os.path.join(resolve_store(store_dir), MANIFEST_FILE))
+
+
+def _prune_versions(store_dir, live, keep=KEEP_VERSIONS):
+    """Remove builds older than the `keep` most recent ones before `live`, and any flat-layout files."""
+    previous = sorted(
+        (name for name in os.listdir(store_dir) if name.startswith(VERSION_PREFIX) and name != live),
+        key=lambda name: os.path.getmtime(os.path.join(store_dir, name)),
+        reverse=True,
+    )
+    for name in previous[keep:]:
+        shutil.rmtree(os.path.join(store_dir, name), ignore_errors=True)
+    if len(previous) >= keep:
+        # A store from before versioned directories counts as the oldest build
+        for name in STORE_FILES:
+            path = os.path.join(store_dir, name)
+            if os.path.isfile(path):
+                os.remove(path)
+
+
+def write_embedding_store(store_dir, embeddings, texts, metadatas, model_name, quantization=QUANTIZATION):
+    """
+    Persist passages and their embeddings in the memory-mapped layout, as a
+    new build that CURRENT is switched to once it is complete.
+    """
+    matrix = _normalize(np.asarray(embeddings, dtype=np.float32))
+    if len(matrix) != len(texts) or len(texts) != len(metadatas):
+        raise ValueError("embeddings, texts and metadatas must have the same length")
+    version = uuid.uuid4().hex
+    build = f"{VERSION_PREFIX}{version}"
+    build_dir = os.path.join(store_dir, build)
+    os.makedirs(build_dir)
+
+    offsets = np.zeros((len(texts), 4), dtype=np.int64)
+
+    def write_passages(f):
+        for i, text in enumerate(texts):
+            data = text.encode("utf-8")
+            offsets[i, :2] = (f.tell(), len(data))
+            f.write(data)
+
+    def write_metadata(f):
+        for i, metadata in enumerate(metadatas):
+            data = json.dumps(_compact_metadata(metadata), separators=(",", ":")).encode("utf-8")
+            offsets[i, 2:] = (f.tell(), len(data))
+            f.write(data)
+    replace_file(os.path.join(build_dir, PASSAGES_FILE), write_passages)
+    replace_file(os.path.join(build_dir, METADATA_FILE), write_metadata)
+
+    save_npy(os.path.join(build_dir, EMBEDDINGS_FILE), matrix)
+    save_npy(os.path.join(build_dir, OFFSETS_FILE), offsets)
+    write_bm25_index(build_dir, texts)
+    ann_lists = write_ivf_index(build_dir, matrix)
+    quantization = write_quantized(build_dir, matrix, quantization)
+
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "model_name": model_name,
+        "count": int(matrix.shape[0]),
+        "dim": int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+        "ann_lists": ann_lists,
+        "quantization": quantization,
+        "version": version,
+    }
+    save_json(os.path.join(build_dir, MANIFEST_FILE), manifest, indent=2)
+    replace_file(os.path.join(store_dir, CURRENT_FILE), lambda f: f.write(build), mode="w")
+    _prune_versions(store_dir, build)
+    print(f"Wrote {manifest['count']} passages to {build_dir}")
+    return manifest
+
+
+def export_index(index, store_dir, model_name):
+    """
+    Export the nodes and embeddings of a llama-index VectorStoreIndex. The
+    export has no chunk IDs or file hashes, so any incremental-build
+    manifest left by build_store is removed.
+    """
+    try:
+        os.remove(os.path.join(store_dir, INDEX_MANIFEST_FILE))
+    except FileNotFoundError:
+        pass
+    embedding_dict = index.vector_store.data.embedding_dict
+    docstore = index.storage_context.docstore
+    embeddings, texts, metadatas = [], [], []
+    for node_id, embedding in embedding_dict.items():
+        node = docstore.get_node(node_id)
+        embeddings.append(embedding)
+        texts.append(node.get_content())
+        metadatas.append(node.metadata)
+    return write_embedding_store(store_dir, embeddings, texts, metadatas, model_name)
+
+
+def scanned_files(store_dir):
+    """
+    Paths of the files a search reads end to end: the manifest, offsets,
+    BM25 postings, IVF lists and the quantized copy (the float32 matrix only
+    when there is none). Re-scored rows and returned passages are random reads.
+    """
+    store_dir = resolve_store(store_dir)
+    with open(os.path.join(store_dir, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    names = [MANIFEST_FILE, OFFSETS_FILE, *BM25_FILES]
+    if manifest.get("ann_lists"):
+        names += IVF_FILES
+    kind = manifest.get("quantization")
+    names += QUANTIZED_FILES[kind] if kind else [EMBEDDINGS_FILE]
+    return [os.path.join(store_dir, name) for name in names]
+
+
+def _top(scores, k):
+    """Positions of the k highest scores, best first."""
+    k = min(k, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def mmr(relevance, embeddings, top_k, lambda_mult):
+    """
+    Maximal Marginal Relevance: pick top_k candidates trading relevance
+    against similarity to those already picked. Pairwise similarities are one
+    matrix product; each pick is a vectorised update. Returns positions into
+    the candidates, in pick order. lambda_mult=1 is plain relevance order.
+    """
+    relevance = np.asarray(relevance, dtype=np.float32)
+    top_k = min(top_k, len(relevance))
+    if lambda_mult >= 1.0 or top_k == 0:
+        return _top(relevance, top_k).tolist()
+    vectors = _normalize(np.asarray(embeddings, dtype=np.float32))
+    similarity = vectors @ vectors.T
+    picked = [int(np.argmax(relevance))]
+    # Highest similarity of each candidate to anything picked so far
+    redundancy = similarity[picked[0]].copy()
+    taken = np.zeros(len(relevance), dtype=bool)
+    taken[picked[0]] = True
+    while len(picked) < top_k:
+        scores = lambda_mult * relevance - (1.0 - lambda_mult) * redundancy
+        scores[taken] = -np.inf
+        best = int(np.argmax(scores))
+        picked.append(best)
+        taken[best] = True
+        np.maximum(redundancy, similarity[best], out=redundancy)
+    return picked
+
+
+def _map_file(path):
+    """Map a file read-only; empty files cannot be mapped, so return b''."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class EmbeddingStore:
+    """Read-only view over a store written by write_embedding_store."""
+
+    def __init__(self, store_dir=STORE_DIR, nprobe=None):
+        self.store_dir = store_dir
+        # The build opened; CURRENT is read once so every file comes from it
+        self.path = path = resolve_store(store_dir)
+        with open(os.path.join(path, MANIFEST_FILE)) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("format_version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported store format in {store_dir}")
+        self.embeddings = np.load(os.path.join(path, EMBEDDINGS_FILE), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, OFFSETS_FILE), mmap_mode="r")
+        self._passages = _map_file(os.path.join(path, PASSAGES_FILE))
+        self._metadata = _map_file(os.path.join(path, METADATA_FILE))
+        self.ann = IVFIndex(path, nprobe or DEFAULT_NPROBE) if self.manifest.get("ann_lists") else None
+        kind = self.manifest.get("quantization")
+        self.quantized = QuantizedMatrix(path, kind) if kind else None
+
+    @property
+    def version(self):
+        return self.manifest["version"]
+
+    @property
+    def model_name(self):
+        return self.manifest["model_name"]
+
+    def __len__(self):
+        return self.manifest["count"]
+
+    def text(self, i):
+        start, length = self.offsets[i, 0], self.offsets[i, 1]
+        return self._passages[start:start + length].decode("utf-8")
+
+    def metadata(self, i):
+        start, length = self.offsets[i, 2], self.offsets[i, 3]
+        return json.loads(self._metadata[start:start + length])
+
+    def search(self, query_embedding, top_k=3, candidates=None, exact=False, nprobe=None):
+        """
+        Cosine search: one matrix-vector product over the whole store, or
+        only over the `candidates` rows when a pre-filter supplies them.
+        Large stores with an IVF index scan only the `nprobe` closest lists,
+        and stores with a quantized copy scan that copy and re-score a short
+        list in full precision, unless exact=True.
+
+        Returns a list of (passage index, score) pairs, best first.
+        """
+        query = _normalize(np.asarray(query_embedding, dtype=np.float32))
+        if candidates is None and self.ann is not None and not exact:
+            candidates = self.ann.candidates(query, nprobe)
+        rows = None if candidates is None else np.sort(np.asarray(candidates, dtype=np.int64))
+        if len(self) == 0 or (rows is not None and len(rows) == 0):
+            return []
+        if self.quantized is not None and not exact:
+            approximate = self.quantized.scores(query, rows)
+            shortlist = _top(approximate, shortlist_size(top_k))
+            rows = shortlist if rows is None else rows[shortlist]
+            rows = np.sort(rows)
+        scores = (self.embeddings if rows is None else self.embeddings[rows]) @ query
+        top = _top(scores, top_k)
+        ids = top if rows is None else rows[top]
+        return [(int(i), float(scores[j])) for i, j in zip(ids, top)]
@@ -1,25 +1,45 @@
-from llama_index.core import VectorStoreIndex, StorageContext
-from llama_index.core.readers import SimpleDirectoryReader
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+from embedding_store import STORE_DIR, export_index
+from index_pipeline import build_store
 import os
 
-# Load a local embedding model
-embed_model = HuggingFaceEmbedding(model_name="sentence-transformers/all-MiniLM-L6-v2")
-
 # Directory containing Augustine's works
 TEXTS_DIR = "./augustine_texts/"
+EMBED_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+# Embedding processes; 0 uses one per core
+INDEX_WORKERS = int(os.getenv("INDEX_WORKERS", "0"))
+# Set INDEX_LEGACY=1 to build a llama-index VectorStoreIndex and export it instead
+# (no boilerplate stripping or de-duplication)
+INDEX_LEGACY = os.getenv("INDEX_LEGACY", "0") == "1"
+
+# Guarded so worker processes can import this module safely
+if __name__ == "__main__":
+    if not INDEX_LEGACY:
+        print(f"Indexing {TEXTS_DIR} with {INDEX_WORKERS or os.cpu_count()} workers")
+        build_store(TEXTS_DIR, STORE_DIR, EMBED_MODEL_NAME, workers=INDEX_WORKERS or None)
+    else:
+        from llama_index.core import VectorStoreIndex
+        from llama_index.core.readers import SimpleDirectoryReader
+        from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+
+        # Load a local embedding model
+        embed_model = HuggingFaceEmbedding(model_name=EMBED_MODEL_NAME)
+
+        # Load documents with verbose output
+        print(f"Loading documents from {TEXTS_DIR}")
+        documents = SimpleDirectoryReader(TEXTS_DIR).load_data()
+        print(f"Loaded {len(documents)} documents")
 
-# Load documents with verbose output
-print(f"Loading documents from {TEXTS_DIR}")
-documents = SimpleDirectoryReader(TEXTS_DIR).load_data()
-print(f"Loaded {len(documents)} documents")
+        # Create an index using local embeddings
+        print("Creating index...")
+        index = VectorStoreIndex.from_documents(documents, embed_model=embed_model)
 
-# Create an index using local embeddings
-print("Creating index...")
-index = VectorStoreIndex.from_documents(documents, embed_model=embed_model)
+        # Persist the index
+        print("Saving index...")
+        index.storage_context.persist(persist_dir="./augustine_index")
 
-# Persist the index
-print("Saving index...")
-index.storage_context.persist(persist_dir="./augustine_index")
+        # Write the memory-mapped embedding store used by RAG.py
+        print("Writing embedding store...")
+        export_index(index, STORE_DIR, EMBED_MODEL_NAME)
 
-print("Indexed Augustine's works successfully with local embeddings!")
\ No newline at end of file
+    print("Indexed Augustine's works successfully with local embeddings!")
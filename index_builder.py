@@ -1,7 +1,9 @@
 # index_builder.py
+import argparse
 from llama_index.core import VectorStoreIndex, StorageContext
 from llama_index.core import SimpleDirectoryReader
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+from index_pipeline import BATCH_SIZE, build_store
 
 def build_index():
     print("Loading documents...")
@@ -16,4 +18,15 @@ def build_index():
     print("Index built and saved!")
 
 if __name__ == "__main__":
-    build_index()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Build the Augustine index")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Embed in parallel with this many processes (writes the embedding store only)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help="Chunks per embedding batch in parallel mode")
+    args = parser.parse_args()
+
+    if args.workers:
+        build_store(workers=args.workers, batch_size=args.batch_size)
+        print("Index built and saved!")
+    else:
+        build_index()
\ No newline at end of file
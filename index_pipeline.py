@@ -0,0 +1,347 @@
+# index_pipeline.py
+"""
+Parallel, batched embedding pipeline for index builds.
+
+Documents are streamed file by file, split into chunks and embedded in
+fixed-size batches across a process pool. Only a bounded number of batches
+is in flight at any time, so memory stays flat however large the corpus is.
+The result is written straight to the memory-mapped embedding store.
+
+A manifest next to the store records the content hash and chunk IDs of every
+source file plus the embedding model, so incremental rebuilds only re-embed
+files that were added or changed and drop the vectors of deleted files.
+
+Before chunking, boilerplate is stripped and repeated passages are dropped
+(see corpus_dedup); each chunk keeps the list of files its text appears in.
+"""
+import hashlib
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from llama_index.core import SimpleDirectoryReader
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import MetadataMode
+
+from corpus_dedup import Deduplicator, source_priority, strip_boilerplate
+from embedding_backends import EMBED_BACKEND, load_embed_model, prepare_backend
+from embedding_store import (INDEX_MANIFEST_FILE, MANIFEST_FILE, STORE_DIR, EmbeddingStore, resolve_store,
+                             write_embedding_store)
+from store_io import save_json
+
+TEXTS_DIR = "./augustine_texts"
+EMBED_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+# Same defaults as VectorStoreIndex.from_documents
+CHUNK_SIZE = 1024
+CHUNK_OVERLAP = 200
+BATCH_SIZE = 64
+
+# Embedding model of the current worker process
+_worker_model = None
+
+
+def list_source_files(texts_dir=TEXTS_DIR):
+    """File names in the corpus directory, skipping hidden files like the reader does."""
+    return sorted(
+        name for name in os.listdir(texts_dir)
+        if not name.startswith(".") and os.path.isfile(os.path.join(texts_dir, name))
+    )
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_id(file_name, content_hash, n):
+    return f"{file_name}:{content_hash[:12]}:{n}"
+
+
+def iter_chunks(texts_dir=TEXTS_DIR, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP,
+                files=None, hashes=None, deduplicator=None):
+    """
+    Yield (text to embed, passage text, metadata) one source file at a time.
+
+    `files` restricts the walk to those file names; `hashes` maps file names
+    to content hashes and is used to derive stable chunk IDs. Boilerplate is
+    always stripped; with a `deduplicator`, files are walked canonical-first
+    and paragraphs already seen elsewhere are dropped.
+    """
+    splitter = SentenceSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    files = list_source_files(texts_dir) if files is None else files
+    files = sorted(files, key=source_priority)
+    hashes = hashes or {}
+    if not files:
+        return
+    reader = SimpleDirectoryReader(input_files=[os.path.join(texts_dir, name) for name in files])
+    for documents in reader.iter_data():
+        spans = {}
+        for document in documents:
+            file_name = document.metadata.get("file_name", "")
+            text = strip_boilerplate(document.get_content())
+            if deduplicator is not None:
+                text, spans[file_name] = deduplicator.dedup_text(file_name, text)
+            document.set_content(text)
+        counts = {}
+        for node in splitter.get_nodes_from_documents(documents):
+            file_name = node.metadata.get("file_name", "")
+            n = counts.get(file_name, 0)
+            counts[file_name] = n + 1
+            content_hash = hashes.get(file_name, "")
+            metadata = dict(node.metadata, chunk_id=chunk_id(file_name, content_hash, n), sources=[file_name])
+            if deduplicator is not None:
+                deduplicator.attach(metadata, node.start_char_idx, node.end_char_idx, spans[file_name])
+            yield (
+                node.get_content(metadata_mode=MetadataMode.EMBED),
+                node.get_content(),
+                metadata,
+            )
+
+
+def iter_batches(items, batch_size=BATCH_SIZE):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _init_worker(model_name, threads, backend=EMBED_BACKEND):
+    """Load the embedding model once per worker, capped to its share of cores."""
+    global _worker_model
+    _worker_model = load_embed_model(model_name, backend, threads)
+
+
+def _embed_batch(texts):
+    return np.asarray(_worker_model.get_text_embedding_batch(texts), dtype=np.float32)
+
+
+class _Progress:
+    """Prints chunks/second at most every `interval` seconds."""
+
+    def __init__(self, interval=5.0):
+        self.interval = interval
+        self.start = self.last = time.perf_counter()
+        self.done = 0
+
+    def update(self, count):
+        self.done += count
+        now = time.perf_counter()
+        if now - self.last >= self.interval:
+            self.last = now
+            rate = self.done / (now - self.start)
+            print(f"Embedded {self.done} chunks ({rate:.1f} chunks/s)")
+
+    def finish(self):
+        elapsed = time.perf_counter() - self.start
+        rate = self.done / elapsed if elapsed else 0.0
+        print(f"Embedded {self.done} chunks in {elapsed:.1f}s ({rate:.1f} chunks/s)")
+
+
+def embed_chunks(chunks, model_name=EMBED_MODEL_NAME, workers=None, batch_size=BATCH_SIZE, max_pending=None,
+                 backend=EMBED_BACKEND):
+    """
+    Embed (text to embed, passage text, metadata) chunks in batches.
+
+    Returns (embeddings, texts, metadatas) in input order. With workers=1
+    the batches are embedded in-process. `backend` selects the inference
+    backend (see embedding_backends).
+    """
+    prepare_backend(model_name, backend)
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or workers * 2
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    embeddings, texts, metadatas = [], [], []
+    progress = _Progress()
+
+    if workers == 1:
+        _init_worker(model_name, threads, backend)
+        for batch in iter_batches(chunks, batch_size):
+            embeddings.append(_embed_batch([c[0] for c in batch]))
+            texts.extend(c[1] for c in batch)
+            metadatas.extend(c[2] for c in batch)
+            progress.update(len(batch))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(model_name, threads, backend)) as pool:
+            pending = deque()
+
+            def collect_oldest():
+                future, batch = pending.popleft()
+                embeddings.append(future.result())
+                texts.extend(c[1] for c in batch)
+                metadatas.extend(c[2] for c in batch)
+                progress.update(len(batch))
+
+            for batch in iter_batches(chunks, batch_size):
+                # Bounded queue: wait for the oldest batch before submitting more
+                if len(pending) >= max_pending:
+                    collect_oldest()
+                pending.append((pool.submit(_embed_batch, [c[0] for c in batch]), batch))
+            while pending:
+                collect_oldest()
+
+    progress.finish()
+    matrix = np.concatenate(embeddings) if embeddings else np.zeros((0, 0), dtype=np.float32)
+    return matrix, texts, metadatas
+
+
+def load_index_manifest(store_dir=STORE_DIR):
+    try:
+        with open(os.path.join(store_dir, INDEX_MANIFEST_FILE)) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def store_version(store_dir=STORE_DIR):
+    """Version of the store in `store_dir`, or None when there is none."""
+    try:
+        with open(os.path.join(resolve_store(store_dir), MANIFEST_FILE)) as f:
+            return json.load(f).get("version")
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def write_index_manifest(store_dir, model_name, hashes, metadatas, dedup=True, version=None):
+    """
+    Record the source file hashes and chunk IDs of the store whose
+    store.json `version` was just written, so a later incremental build can
+    tell whether the manifest still describes that store.
+    """
+    files = {name: {"hash": content_hash, "chunk_ids": []} for name, content_hash in hashes.items()}
+    for metadata in metadatas:
+        # A de-duplicated chunk stands in for the passage in every file it came from
+        for source in metadata.get("sources") or [metadata.get("file_name")]:
+            entry = files.get(source)
+            if entry is not None and metadata.get("chunk_id"):
+                entry["chunk_ids"].append(metadata["chunk_id"])
+    manifest = {"model_name": model_name, "dedup": dedup, "store_version": version, "files": files}
+    save_json(os.path.join(store_dir, INDEX_MANIFEST_FILE), manifest, indent=1)
+    return manifest
+
+
+def _files_to_rechunk(rows, changed, deleted, hashes):
+    """
+    Changed files plus every file whose passages were folded into a chunk of
+    a changed or deleted file: those lose their canonical copy and must be
+    chunked again.
+    """
+    rechunk = set(changed)
+    gone = rechunk | set(deleted)
+    grew = True
+    while grew:
+        grew = False
+        for metadata in rows:
+            if metadata.get("file_name") not in gone:
+                continue
+            for source in metadata.get("sources", []):
+                if source in hashes and source not in gone:
+                    rechunk.add(source)
+                    gone.add(source)
+                    grew = True
+    return rechunk, gone
+
+
+def _outranked_files(texts_dir, rechunk, rows, texts, gone):
+    """
+    Kept files holding the canonical copy of a paragraph that a re-chunked
+    file outranks (source_priority): a full build would give the paragraph
+    to the re-chunked file, so they must be chunked again too.
+    """
+    probe = Deduplicator()
+    for text, metadata in zip(texts, rows):
+        if metadata.get("file_name") not in gone:
+            probe.seed(text, metadata)
+    reader = SimpleDirectoryReader(input_files=[os.path.join(texts_dir, name) for name in sorted(rechunk)])
+    outranked = set()
+    for documents in reader.iter_data():
+        for document in documents:
+            file_name = document.metadata.get("file_name", "")
+            for holder in probe.holders(strip_boilerplate(document.get_content())):
+                if holder not in gone and source_priority(holder) > source_priority(file_name):
+                    outranked.add(holder)
+    return outranked
+
+
+def build_store(texts_dir=TEXTS_DIR, store_dir=STORE_DIR, model_name=EMBED_MODEL_NAME,
+                workers=None, batch_size=BATCH_SIZE, incremental=False, dedup=True):
+    """
+    Chunk, embed and write the corpus to the embedding store.
+
+    With incremental=True only files whose content hash changed (or that are
+    new) are re-embedded. A missing manifest or a different embedding model
+    forces a full rebuild. With dedup=True repeated passages are embedded once.
+    """
+    hashes = {name: file_hash(os.path.join(texts_dir, name)) for name in list_source_files(texts_dir)}
+    manifest = load_index_manifest(store_dir) if incremental else None
+    if manifest and manifest.get("model_name") != model_name:
+        print(f"Embedding model changed ({manifest.get('model_name')} -> {model_name}), rebuilding everything")
+        manifest = None
+    if manifest and manifest.get("dedup", True) != dedup:
+        print("De-duplication setting changed, rebuilding everything")
+        manifest = None
+    if manifest and manifest.get("store_version") != store_version(store_dir):
+        # The store was rewritten (e.g. by export_index) after this manifest
+        print("Index manifest does not match the embedding store, rebuilding everything")
+        manifest = None
+
+    deduplicator = Deduplicator() if dedup else None
+    kept_embeddings, kept_texts, kept_metadatas = None, [], []
+    if manifest:
+        previous = manifest["files"]
+        changed = [name for name, h in hashes.items() if previous.get(name, {}).get("hash") != h]
+        deleted = [name for name in previous if name not in hashes]
+        if not changed and not deleted:
+            print("Index is up to date")
+            return None
+        store = EmbeddingStore(store_dir)
+        rows = [store.metadata(i) for i in range(len(store))]
+        row_texts = [store.text(i) for i in range(len(store))]
+        rechunk, gone = _files_to_rechunk(rows, changed, deleted, hashes)
+        if dedup:
+            checked = set()
+            while rechunk - checked:
+                outranked = _outranked_files(texts_dir, rechunk - checked, rows, row_texts, gone)
+                checked |= rechunk
+                rechunk, gone = _files_to_rechunk(rows, sorted(rechunk | outranked), deleted, hashes)
+        print(f"Re-embedding {len(changed)} changed files ({len(rechunk)} with linked duplicates), "
+              f"removing {len(deleted)} deleted files")
+        keep = [i for i, metadata in enumerate(rows) if metadata.get("file_name") in set(hashes) - gone]
+        kept_embeddings = np.asarray(store.embeddings[keep], dtype=np.float32)
+        for i in keep:
+            metadata = rows[i]
+            metadata["sources"] = [s for s in metadata.get("sources", [metadata.get("file_name")]) if s not in gone]
+            kept_texts.append(row_texts[i])
+            kept_metadatas.append(metadata)
+            if deduplicator is not None:
+                deduplicator.seed(kept_texts[-1], metadata)
+        files = sorted(rechunk)
+    else:
+        files = list(hashes)
+
+    print(f"Embedding {len(files)} files from {texts_dir} with {workers or os.cpu_count()} workers, batch size {batch_size}")
+    embeddings, texts, metadatas = embed_chunks(
+        iter_chunks(texts_dir, files=files, hashes=hashes, deduplicator=deduplicator),
+        model_name=model_name, workers=workers, batch_size=batch_size
+    )
+    if deduplicator is not None:
+        deduplicator.report()
+    if kept_embeddings is not None and len(kept_embeddings):
+        embeddings = np.concatenate([kept_embeddings, embeddings]) if len(embeddings) else kept_embeddings
+    texts = kept_texts + texts
+    metadatas = kept_metadatas + metadatas
+
+    store_manifest = write_embedding_store(store_dir, embeddings, texts, metadatas, model_name)
+    write_index_manifest(store_dir, model_name, hashes, metadatas, dedup=dedup, version=store_manifest["version"])
+    return store_manifest
@@ -1,6 +1,7 @@
 import openai
 import os
 from dotenv import load_dotenv
+from metrics import log_sampled
 
 # Load environment variables from .env file
 load_dotenv()
@@ -33,15 +34,43 @@ Maintain your role as Augustine while directly addressing the current conversati
     }
     return prompts.get(persona, "You are a wise sage...")
 
+class LLMError(Exception):
+    """A completion failed; the message is safe to show to the user."""
+
+def llm_error(e):
+    """LLMError with the same message openai_call returns for `e`."""
+    if isinstance(e, openai.APITimeoutError):
+        return LLMError("Request timed out. Please try again later.")
+    if isinstance(e, openai.APIError):
+        return LLMError(f"Error with OpenAI API: {str(e)}")
+    return LLMError(f"Unexpected error: {str(e)}")
+
+# Shared async client; one connection pool for all requests
+_async_openai_client = None
+
+def get_async_openai_client():
+    global _async_openai_client
+    if _async_openai_client is None:
+        _async_openai_client = openai.AsyncOpenAI()
+    return _async_openai_client
+
+def log_llm_call(provider, messages, stream=False):
+    """
+    Sampled structured log of an outgoing LLM request: sizes and the start of
+    the question, never the full prompt.
+    """
+    log_sampled(
+        "llm_request",
+        provider=provider,
+        stream=stream,
+        messages=len(messages),
+        prompt_chars=sum(len(msg["content"]) for msg in messages),
+        question=messages[-1]["content"].rsplit("\n\n", 1)[-1][:80],
+    )
+
 def openai_call(messages):
     try:
-        # Print the messages being sent to ChatGPT
-        print("\n=== Messages being sent to ChatGPT ===")
-        for msg in messages:
-            print(f"\nRole: {msg['role']}")
-            print(f"Content: {msg['content']}\n")
-        print("=====================================\n")
-
+        log_llm_call("openai", messages)
         client = openai.OpenAI()
         response = client.chat.completions.create(
             model="gpt-3.5-turbo",
@@ -49,21 +78,51 @@ def openai_call(messages):
             timeout=30
         )
         return response.choices[0].message.content.strip()
-    except openai.APITimeoutError as e:
+    except openai.APITimeoutError:
         return "Request timed out. Please try again later."
     except openai.APIError as e:
         return f"Error with OpenAI API: {str(e)}"
     except Exception as e:
         return f"Unexpected error: {str(e)}"
 
-def query_llm(query, context, persona, provider='openai'):
-    # Print the raw inputs
-    print("\n=== Raw Inputs ===")
-    print(f"Query: {query}")
-    print(f"Context: {context}")
-    print(f"Persona: {persona}")
-    print("=================\n")
+async def async_openai_call(messages):
+    """
+    Same as openai_call, on the async client so the event loop keeps serving
+    other requests while the completion is pending. Failures raise LLMError
+    instead of returning the message as the answer.
+    """
+    try:
+        log_llm_call("openai", messages)
+        response = await get_async_openai_client().chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=messages,
+            timeout=30
+        )
+        return response.choices[0].message.content.strip()
+    except Exception as e:
+        raise llm_error(e) from e
+
+async def stream_openai_call(messages):
+    """
+    Stream the completion, yielding text deltas as they arrive. A failure,
+    even after some deltas, raises LLMError, so a partial answer is never
+    mistaken for a complete one.
+    """
+    try:
+        log_llm_call("openai", messages, stream=True)
+        stream = await get_async_openai_client().chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=messages,
+            timeout=30,
+            stream=True
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    except Exception as e:
+        raise llm_error(e) from e
 
+def query_llm(query, context, persona, provider='openai'):
     messages = [
         {"role": "system", "content": get_prompt(persona)},
         {"role": "user", "content": f"{context}\n\n{query}"}
@@ -128,4 +187,31 @@ def get_llm_response(question, context, mode, persona):
     :return: The generated response from the LLM.
     """
     # Use the query_llm function to get the response
-    return query_llm(question, context, persona, provider='openai')  # Default to OpenAI
\ No newline at end of file
+    return query_llm(question, context, persona, provider='openai')  # Default to OpenAI
+
+async def async_query_llm(query, context, persona, provider='openai'):
+    messages = [
+        {"role": "system", "content": get_prompt(persona)},
+        {"role": "user", "content": f"{context}\n\n{query}"}
+    ]
+    if provider == 'openai':
+        return await async_openai_call(messages)
+    # The other providers are still placeholders without an async client
+    return query_llm(query, context, persona, provider=provider)
+
+async def stream_llm_response(question, context, mode, persona):
+    """
+    Streaming variant of get_llm_response: an async iterator of text deltas.
+    """
+    messages = [
+        {"role": "system", "content": get_prompt(persona)},
+        {"role": "user", "content": f"{context}\n\n{question}"}
+    ]
+    async for delta in stream_openai_call(messages):
+        yield delta
+
+async def async_get_llm_response(question, context, mode, persona):
+    """
+    Async variant of get_llm_response for the API endpoints.
+    """
+    return await async_query_llm(question, context, persona, provider='openai')
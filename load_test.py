@@ -0,0 +1,408 @@
+# load_test.py
+"""
+Offline load test of the serving path.
+
+Drives /api/v1/chat (as multi-turn sessions), /ask, /tweet and /wise_tweet
+with a configurable number of concurrent virtual users and request mix.
+Everything outside this service is replaced by a stand-in: a fake LLM with
+configurable latency and token rate answers for OpenAI and Ollama, and an
+SQLite chat store takes the place of MySQL. Retrieval runs against the
+local embedding store unless --fake-retrieval is given. The app is served
+in-process, so no server, API key or database is needed:
+
+    python load_test.py --concurrency 32 --duration 30 --mix chat=6,ask=2,tweet=2 --turns 3
+
+Prints a JSON report of throughput, latency percentiles and error rates per
+endpoint, plus the server's admission, coalescing and cache counters. Save
+it per commit and diff to catch serving-path regressions. Pass --url to
+drive a running server instead (its LLMs and database are then real).
+"""
+import os
+
+# Never reach out to the Hugging Face hub; the model must already be cached
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import sqlite3
+import threading
+import time
+
+import httpx
+import numpy as np
+
+import main as api
+import RAG
+from benchmark_retrieval import QUESTIONS_FILE, git_commit, load_questions, percentiles
+from caching import normalize_question
+from context_packer import lexical_scores
+from models import Passage
+
+DEFAULT_MIX = "chat=6,ask=2,tweet=1,wise_tweet=1"
+ENDPOINTS = {
+    "chat": ("POST", "/api/v1/chat"),
+    "ask": ("POST", "/ask"),
+    "tweet": ("GET", "/tweet"),
+    "wise_tweet": ("GET", "/wise_tweet"),
+}
+# Later turns of a chat session
+FOLLOW_UPS = [
+    "Can you say more about that?",
+    "How does that apply to daily life?",
+    "Where do you write about this?",
+    "What did we discuss?",
+]
+TWEET_PROMPTS = [
+    "the restless heart",
+    "the nature of time",
+    "friendship and grief",
+    "the two cities",
+]
+# Completion length of the tweet client
+TWEET_TOKENS = 40
+# all-MiniLM-L6-v2 dimensions, for --fake-retrieval question vectors
+EMBED_DIM = 384
+# Filler vocabulary for fake completions and passages
+WORDS = (
+    "grace love truth God soul heart will time memory city peace rest sin mercy "
+    "light word faith hope wisdom desire eternity creation order beauty"
+).split()
+
+
+class FakeCompletion:
+    """Enough of a llama-index CompletionResponse for the API."""
+
+    def __init__(self, text, delta=None):
+        self.text = text
+        self.delta = delta
+
+    def __str__(self):
+        return self.text
+
+
+class FakeLLM:
+    """
+    Stand-in for OpenAI and Ollama: the first token arrives after `latency`
+    seconds, then `tokens` words follow at `token_rate` per second.
+    """
+
+    def __init__(self, latency=0.5, token_rate=30.0, tokens=120, model="augustine", temperature=0.7):
+        self.latency = latency
+        self.token_rate = token_rate
+        self.tokens = tokens
+        self.model = model
+        self.temperature = temperature
+        self.calls = 0
+
+    def _words(self, prompt):
+        rng = random.Random(hashlib.sha1(prompt.encode("utf-8")).digest())
+        return [rng.choice(WORDS) for _ in range(self.tokens)]
+
+    def _generation_time(self):
+        return self.latency + (self.tokens / self.token_rate if self.token_rate > 0 else 0.0)
+
+    async def _deltas(self, prompt):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        interval = 1.0 / self.token_rate if self.token_rate > 0 else 0.0
+        for word in self._words(prompt):
+            await asyncio.sleep(interval)
+            yield word + " "
+
+    async def acomplete(self, prompt, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self._generation_time())
+        return FakeCompletion(" ".join(self._words(prompt)))
+
+    async def astream_complete(self, prompt, **kwargs):
+        async def stream():
+            text = ""
+            async for delta in self._deltas(prompt):
+                text += delta
+                yield FakeCompletion(text, delta)
+        return stream()
+
+    async def get_llm_response(self, question, context, mode, persona):
+        return str(await self.acomplete(f"{context}\n\n{question}"))
+
+    async def stream_llm_response(self, question, context, mode, persona):
+        async for delta in self._deltas(f"{context}\n\n{question}"):
+            yield delta
+
+
+class SQLiteChatStore:
+    """Stand-in for mysql_memory: the chat_ui_history table in SQLite."""
+
+    def __init__(self, path=":memory:"):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS chat_ui_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT,
+                session_id TEXT,
+                role TEXT,
+                message TEXT,
+                timestamp TEXT DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE INDEX IF NOT EXISTS session_id_idx ON chat_ui_history (session_id, id);
+        """)
+        self._lock = threading.Lock()
+
+    def _select(self, query, params):
+        with self._lock:
+            return [dict(row) for row in self.connection.execute(query, params).fetchall()]
+
+    def store_chat_turn(self, user_id, session_id, question, response):
+        query = "INSERT INTO chat_ui_history (user_id, session_id, role, message) VALUES (?, ?, ?, ?)"
+        with self._lock:
+            question_id = self.connection.execute(query, (user_id, session_id, "user", question)).lastrowid
+            response_id = self.connection.execute(query, (user_id, session_id, "assistant", response)).lastrowid
+            self.connection.commit()
+        return question_id, response_id
+
+    def retrieve_recent_messages(self, session_id, limit):
+        return self._select(
+            "SELECT id, role, message, timestamp FROM chat_ui_history "
+            "WHERE session_id = ? ORDER BY id DESC LIMIT ?", (session_id, limit)
+        )[::-1]
+
+    def retrieve_chat_page(self, session_id, after=None, before=None, limit=50):
+        if after is not None:
+            records = self._select(
+                "SELECT id, role, message, timestamp FROM chat_ui_history "
+                "WHERE session_id = ? AND id > ? ORDER BY id LIMIT ?", (session_id, after, limit + 1)
+            )
+            return records[:limit], len(records) > limit
+        records = self._select(
+            "SELECT id, role, message, timestamp FROM chat_ui_history "
+            "WHERE session_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+            (session_id, before if before is not None else 2**63 - 1, limit + 1),
+        )
+        return records[:limit][::-1], len(records) > limit
+
+    def pool_stats(self):
+        return {"size": 1, "in_use": 0}
+
+
+def fake_embedding(question, author=None):
+    """Unit vector seeded by the normalized question, so repeats match."""
+    seed = hashlib.sha1(normalize_question(question).encode("utf-8")).digest()
+    vector = np.random.default_rng(list(seed)).standard_normal(EMBED_DIM).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def fake_passages(question, persona):
+    rng = random.Random(normalize_question(question))
+    return [
+        Passage(
+            text=" ".join(rng.choice(WORDS) for _ in range(150)) + ".",
+            work="Confessions",
+            book=str(n),
+            file_name=f"confessions_book_{n}.txt",
+            score=1.0 / n,
+            sources=[f"confessions_book_{n}.txt"],
+        )
+        for n in range(1, 4)
+    ]
+
+
+def install_standins(llm, tweet_llm, chat_store, fake_retrieval=False):
+    """Point the app at the stand-ins instead of OpenAI, Ollama and MySQL."""
+    def create_llm_clients():
+        api.tweet_llm = tweet_llm
+        api.llm = llm
+
+    api.create_llm_clients = create_llm_clients
+    api.async_get_llm_response = llm.get_llm_response
+    api.stream_llm_response = llm.stream_llm_response
+    api.store_chat_turn = chat_store.store_chat_turn
+    api.retrieve_recent_messages = chat_store.retrieve_recent_messages
+    api.retrieve_chat_page = chat_store.retrieve_chat_page
+    api.pool_stats = chat_store.pool_stats
+    api.load_tweet_prompts = lambda: TWEET_PROMPTS
+    if fake_retrieval:
+        RAG.warm_up = lambda allow_build=False: None
+        api.get_passages = fake_passages
+        api.question_embedding = fake_embedding
+        api.score_sentences = lambda question, sentences, author=None: lexical_scores(question, sentences)
+
+
+def parse_mix(spec):
+    """Parse "chat=6,ask=2" into {endpoint: weight}."""
+    mix = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        kind, _, weight = item.partition("=")
+        if kind not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint {kind!r}; use one of {', '.join(ENDPOINTS)}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+async def timed_request(client, results, kind, **kwargs):
+    """Send one request and record (kind, status or error name, seconds)."""
+    method, path = ENDPOINTS[kind]
+    start = time.perf_counter()
+    body = None
+    try:
+        response = await client.request(method, path, **kwargs)
+        status = response.status_code
+        if status == 200:
+            body = response.json()
+    except Exception as e:
+        status = type(e).__name__
+    results.append((kind, status, time.perf_counter() - start))
+    return body
+
+
+async def virtual_user(client, results, mix, questions, turns, deadline, think_time, rng):
+    kinds, weights = zip(*mix.items())
+    while time.perf_counter() < deadline:
+        kind = rng.choices(kinds, weights)[0]
+        if kind == "chat":
+            session_id = None
+            for turn in range(turns):
+                question = rng.choice(questions) if turn == 0 else rng.choice(FOLLOW_UPS)
+                body = await timed_request(client, results, kind,
+                                           json={"question": question, "session_id": session_id})
+                if body is None or time.perf_counter() >= deadline:
+                    break
+                session_id = body["session_id"]
+                await asyncio.sleep(think_time)
+        elif kind == "ask":
+            await timed_request(client, results, kind, json={"question": rng.choice(questions)})
+        else:
+            await timed_request(client, results, kind)
+        await asyncio.sleep(think_time)
+
+
+def summarize(results, elapsed):
+    """Throughput, latency percentiles and errors per endpoint and overall."""
+    def summary(rows):
+        errors = {}
+        for _, status, _ in rows:
+            if status != 200:
+                errors[str(status)] = errors.get(str(status), 0) + 1
+        failed = sum(errors.values())
+        return {
+            "requests": len(rows),
+            "throughput_rps": len(rows) / elapsed if elapsed else 0.0,
+            "error_rate": failed / len(rows) if rows else 0.0,
+            "errors": errors,
+            "latency": percentiles([seconds for _, status, seconds in rows if status == 200]),
+        }
+
+    report = {kind: summary([row for row in results if row[0] == kind])
+              for kind in sorted({row[0] for row in results})}
+    report["total"] = summary(results)
+    return report
+
+
+async def wait_ready(client, timeout):
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            if (await client.get("/api/v1/ready")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        if time.perf_counter() >= deadline:
+            raise RuntimeError(f"Service not ready after {timeout:g}s")
+        await asyncio.sleep(0.5)
+
+
+async def server_counters(client):
+    counters = {}
+    for name, path in (("admission", "/api/v1/admission"), ("coalescing", "/api/v1/coalescing/stats"),
+                       ("answer_cache", "/api/v1/cache/answers"), ("tweet_pools", "/api/v1/tweets/pool")):
+        try:
+            counters[name] = (await client.get(path)).json()
+        except Exception as e:
+            counters[name] = {"error": str(e)}
+    return counters
+
+
+async def load_test(client, args, mix, questions):
+    await wait_ready(client, args.ready_timeout)
+    results = []
+    rng = random.Random(args.seed)
+    start = time.perf_counter()
+    deadline = start + args.duration
+    await asyncio.gather(*(
+        virtual_user(client, results, mix, questions, args.turns, deadline, args.think_time,
+                     random.Random(rng.random()))
+        for _ in range(args.concurrency)
+    ))
+    elapsed = time.perf_counter() - start
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "target": args.url or "in-process",
+        "concurrency": args.concurrency,
+        "duration_s": elapsed,
+        "mix": mix,
+        "turns": args.turns,
+        "llm": None if args.url else {"latency_s": args.llm_latency, "token_rate": args.token_rate,
+                                      "tokens": args.tokens},
+        "fake_retrieval": args.fake_retrieval,
+        "endpoints": summarize(results, elapsed),
+        "server": await server_counters(client),
+    }
+
+
+async def run(args):
+    mix = parse_mix(args.mix)
+    questions = [item["question"] for item in load_questions(args.questions)]
+    if args.url:
+        limits = httpx.Limits(max_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+            return await load_test(client, args, mix, questions)
+
+    llm = FakeLLM(args.llm_latency, args.token_rate, args.tokens)
+    tweet_llm = FakeLLM(args.llm_latency, args.token_rate, min(args.tokens, TWEET_TOKENS))
+    install_standins(llm, tweet_llm, SQLiteChatStore(args.sqlite), args.fake_retrieval)
+    if args.no_answer_cache:
+        api.answer_cache.maxsize = 0
+    async with api.lifespan(api.app):
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://load-test", timeout=args.timeout) as client:
+            report = await load_test(client, args, mix, questions)
+    report["llm"]["calls"] = llm.calls + tweet_llm.calls
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the API against stand-in LLMs and chat store")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to generate load for")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Endpoint weights, from {', '.join(ENDPOINTS)}")
+    parser.add_argument("--turns", type=int, default=3, help="Requests per chat session")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Seconds a user waits between requests")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Fake LLM time to first token, seconds")
+    parser.add_argument("--token-rate", type=float, default=30.0, help="Fake LLM tokens per second")
+    parser.add_argument("--tokens", type=int, default=120, help="Fake LLM completion length, tokens")
+    parser.add_argument("--sqlite", default=":memory:", help="SQLite file for the chat store")
+    parser.add_argument("--fake-retrieval", action="store_true", help="Skip the embedding model and index")
+    parser.add_argument("--no-answer-cache", action="store_true", help="Disable the semantic answer cache")
+    parser.add_argument("--questions", default=QUESTIONS_FILE, help="Questions to ask (JSON)")
+    parser.add_argument("--url", default=None, help="Drive a running server instead of the in-process app")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout, seconds")
+    parser.add_argument("--ready-timeout", type=float, default=300.0, help="Seconds to wait for /ready")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the request sequence")
+    parser.add_argument("--output", default=None, help="Write the JSON report here as well as stdout")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,194 @@
-from fastapi import FastAPI, HTTPException, APIRouter
+from fastapi import FastAPI, HTTPException, APIRouter, Request
 from fastapi.middleware.cors import CORSMiddleware
-from llama_index.llms.ollama import Ollama
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from contextlib import asynccontextmanager
 from models import Query, TweetResponse, Query
 # from RAG import get_context 
 import json
 import random
 import sys
 import os
-from RAG import get_context
-from llm_router import get_llm_response
-from mysql_memory import store_chat_message, retrieve_chat_history
+import asyncio
+import contextvars
+import functools
+import hashlib
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import RAG
+from RAG import retrieve, score_sentences, question_embedding, cache_stats, shard_stats
+from context_packer import pack_context, format_history_line, approximate_tokens, HISTORY_MAX_MESSAGES
+from caching import SemanticCache, SingleFlight, normalize_question
+from tweet_pool import TweetPool, TWEET_POOL_SIZE
+from admission import (AdmissionController, Overloaded, OLLAMA_CONCURRENCY, OPENAI_CONCURRENCY,
+                       PRIORITY_ASK, PRIORITY_BACKGROUND, PRIORITY_CHAT, PRIORITY_TWEET)
+from llm_router import LLMError, async_get_llm_response, stream_llm_response
+from mysql_memory import store_chat_turn, retrieve_recent_messages, retrieve_chat_page, pool_stats
+import metrics
+from metrics import stage, record_generation
 import uuid  # Add this import for generating session IDs
 
+# Bounded pools for blocking work, so it never runs on the event loop:
+# CPU-bound retrieval (embedding, search, context packing) and MySQL calls
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", str(min(4, os.cpu_count() or 1))))
+DB_WORKERS = int(os.getenv("DB_WORKERS", "8"))
+retrieval_executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+
+async def run_in(executor, func, *args, **kwargs):
+    """
+    Run a blocking call on one of the bounded executors and await it. The
+    request's context (stage timings) goes along to the worker thread.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(executor, functools.partial(context.run, func, *args, **kwargs))
+
+# Identical concurrent LLM and retrieval calls share one in-flight result
+flights = SingleFlight()
+
+def llm_key(kind, client, prompt, **params):
+    """
+    Coalescing key: normalised prompt plus the model and sampling parameters.
+    """
+    model = (getattr(client, "model", None), getattr(client, "temperature", None))
+    return (kind, *model, normalize_question(prompt), tuple(sorted(params.items())))
+
+# Concurrency slots and wait queues per LLM provider; tweet_llm and llm share one Ollama
+admission = {
+    "ollama": AdmissionController("ollama", OLLAMA_CONCURRENCY),
+    "openai": AdmissionController("openai", OPENAI_CONCURRENCY),
+}
+
+async def admitted(provider, priority, func, *args, **kwargs):
+    """
+    Await an LLM call once the provider has a free slot for it, recording
+    its generation rate.
+    """
+    async with admission[provider].slot(priority):
+        start = time.perf_counter()
+        response = await func(*args, **kwargs)
+    record_generation(provider, approximate_tokens(str(response)), time.perf_counter() - start)
+    return response
+
+def reject_if_full(provider):
+    """
+    Fail fast before a stream starts, while a 429 can still be sent.
+    """
+    if admission[provider].is_full():
+        admission[provider].rejected += 1
+        raise Overloaded(provider, "queue full")
+
+async def complete(kind, client, prompt, priority=PRIORITY_TWEET, **params):
+    """
+    Ollama completion, shared with any identical request already in flight.
+    """
+    key = llm_key(kind, client, prompt, **params)
+    return await flights.run(key, admitted, "ollama", priority, client.acomplete, prompt, **params)
+
+# Answers to paraphrased questions, scoped by endpoint, persona and mode
+answer_cache = SemanticCache()
+
+async def lookup_answer(kind, query):
+    """
+    Look the question up in the answer cache. Returns (cached answer or None,
+    question embedding to store a fresh answer under); the embedding is None
+    while the cache is off or the embedding model is still loading.
+    """
+    if not answer_cache.enabled or not readiness["retriever"]:
+        return None, None
+    with stage("answer_cache"):
+        embedding = await run_in(retrieval_executor, question_embedding, query.question, query.persona)
+        return answer_cache.get((kind, query.persona, query.mode), embedding), embedding
+
+def remember_answer(kind, query, embedding, answer):
+    """
+    Cache a generated answer. Only called once a generation succeeded;
+    failed LLM calls raise instead of returning an answer.
+    """
+    if embedding is not None and answer:
+        answer_cache.put((kind, query.persona, query.mode), query.question, embedding, answer)
+
+# Heavy components are loaded in the background; see warm_up()
+readiness = {"retriever": False, "llm": False, "error": None}
+tweet_llm = None
+llm = None
+
+def create_llm_clients():
+    """
+    Create the Ollama clients used by the tweet and ask endpoints.
+    """
+    global tweet_llm, llm
+    from llama_index.llms.ollama import Ollama
+
+    # Initialize Ollama for tweets
+    tweet_llm = Ollama(
+        model="augustine",
+        temperature=0.7,
+        max_tokens=100,
+    )
+
+    # Initialize Ollama with custom parameters
+    llm = Ollama(
+        model="augustine",
+        temperature=0.7,
+        context_window=4096,  # Increased context window
+        max_tokens=1000,      # Increased max response length
+        num_predict=1000,     # Alternative way to control response length
+    )
+
+def warm_up():
+    """
+    Create the LLM clients, then load the embedding model and default index
+    shard. Runs in a background thread so uvicorn serves /health meanwhile.
+    A missing index is reported, never rebuilt here.
+    """
+    try:
+        create_llm_clients()
+        readiness["llm"] = True
+        print("LLM clients ready")
+        RAG.warm_up()
+        readiness["retriever"] = True
+        print("Retriever ready")
+    except Exception as e:
+        readiness["error"] = str(e)
+        print(f"Error during warm-up: {str(e)}")
+
+def require_ready(*components):
+    """
+    Fail fast with 503 while the components a request needs are still loading.
+    """
+    missing = [component for component in components if not readiness[component]]
+    if missing:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Service warming up: {', '.join(missing)} not ready",
+            headers={"Retry-After": "5"},
+        )
+
+@asynccontextmanager
+async def lifespan(app):
+    warm_up_task = asyncio.create_task(asyncio.to_thread(warm_up))
+    for pool in tweet_pools.values():
+        pool.start()
+    yield
+    for pool in tweet_pools.values():
+        await pool.stop()
+    if not warm_up_task.done():
+        warm_up_task.cancel()
+    retrieval_executor.shutdown(wait=False)
+    db_executor.shutdown(wait=False)
+
 # Initialize FastAPI
-app = FastAPI(title="Augustine API")
+app = FastAPI(title="Augustine API", lifespan=lifespan)
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request, exc):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
 
 
 api_v1_router = APIRouter(prefix="/api/v1")
@@ -28,18 +203,48 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def time_request(request: Request, call_next):
+    """
+    Record request latency, and label stage timings with the route. With
+    TIMING_HEADER=1 or an `X-Timing: 1` request header, the response carries
+    the per-stage breakdown as a Server-Timing header. Streamed responses
+    are timed until their headers are sent.
+    """
+    metrics.current_scope.set(request.scope)
+    timings = {} if metrics.TIMING_HEADER or request.headers.get("x-timing") == "1" else None
+    metrics.request_timings.set(timings)
+    start = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - start
+    metrics.request_seconds.observe(elapsed, metrics.endpoint_label(), str(response.status_code))
+    if timings is not None:
+        timings["total"] = elapsed
+        response.headers["Server-Timing"] = metrics.server_timing(timings)
+    return response
+
+
 
+# Go up one directory from api/main.py to find tweet_prompts.json
+TWEET_PROMPTS_PATH = os.path.join(os.path.dirname(__file__), '..', 'tweet_prompts.json')
+# Parsed prompts and the mtime of the file they were read from
+_tweet_prompts = {"mtime": None, "prompts": None}
 
 def load_tweet_prompts():
-    # Go up one directory from api/main.py to find tweet_prompts.json
-    prompts_path = os.path.join(os.path.dirname(__file__), '..', 'tweet_prompts.json')
-    print(f"Looking for prompts file at: {prompts_path}")  # Debug print
-    
-    if not os.path.exists(prompts_path):
+    """
+    Prompts from tweet_prompts.json, re-read only when the file's mtime changes.
+    """
+    prompts_path = TWEET_PROMPTS_PATH
+    try:
+        mtime = os.stat(prompts_path).st_mtime
+    except OSError:
         raise HTTPException(
             status_code=500,
             detail=f"Prompts file not found at {prompts_path}"
         )
+    if _tweet_prompts["mtime"] == mtime:
+        return _tweet_prompts["prompts"]
+    print(f"Loading prompts file at: {prompts_path}")
     
     try:
         with open(prompts_path, 'r') as f:
@@ -49,6 +254,7 @@ def load_tweet_prompts():
                     status_code=500,
                     detail="No prompts found in prompts file"
                 )
+            _tweet_prompts.update(mtime=mtime, prompts=data['prompts'])
             return data['prompts']
     except json.JSONDecodeError as e:
         raise HTTPException(
@@ -61,180 +267,552 @@ def load_tweet_prompts():
             detail=f"Error loading prompts: {str(e)}"
         )
 
-# Initialize Ollama for tweets
-tweet_llm = Ollama(
-    model="augustine",
-    temperature=0.7,
-    max_tokens=100,
-)
+WISE_TWEET_PROMPT = "Share a brief, profound spiritual insight or reflection in a tweet (maximum 280 characters, no hashtags, no icons, no emojis)."
+
+def clean_tweet(response, collapse_whitespace=True):
+    """
+    Strip the completion and cut it to tweet length.
+    """
+    tweet = str(response).strip()
+    if collapse_whitespace:
+        tweet = " ".join(tweet.split())  # Replace all whitespace with single spaces
+    
+    # Ensure tweet length
+    if len(tweet) > 280:
+        tweet = tweet[:277] + "..."
+    return tweet
+
+async def tweet_completion(prompt, shared):
+    """
+    Ollama tweet completion; shared=False skips coalescing, so the pool
+    never receives a copy of a tweet a client was just served.
+    """
+    if shared:
+        return await complete("tweet", tweet_llm, prompt)
+    return await admitted("ollama", PRIORITY_BACKGROUND, tweet_llm.acomplete, prompt)
+
+async def live_tweet(shared=True):
+    """
+    Generate a tweet for a random prompt from tweet_prompts.json.
+    """
+    # Get prompts
+    prompts = load_tweet_prompts()
+    if not prompts:
+        raise HTTPException(status_code=500, detail="No prompts available")
+    
+    # Select random prompt
+    prompt = random.choice(prompts)
+    
+    # Add specific instruction for tweet length
+    full_prompt = f"Provide a tweet-length response (maximum 280 characters, no hashtags, no icons, no emojis) to: {prompt}"
+    
+    # Get response from Ollama
+    response = await tweet_completion(full_prompt, shared)
+    return TweetResponse(
+        tweet=clean_tweet(response),
+        prompt=prompt
+    )
+
+async def live_wise_tweet(shared=True):
+    """
+    Generate a tweet-length spiritual insight.
+    """
+    response = await tweet_completion(WISE_TWEET_PROMPT, shared)
+    return {"tweet": clean_tweet(response, collapse_whitespace=False)}
+
+def llm_idle():
+    """
+    Pools only generate while the LLM is loaded and no call, streamed or
+    not, is running on or waiting for Ollama.
+    """
+    return readiness["llm"] and admission["ollama"].is_idle()
+
+# Ready-made tweets for /tweet and /wise_tweet, refilled in the background
+tweet_pools = {
+    "tweet": TweetPool("tweet", functools.partial(live_tweet, shared=False), is_idle=llm_idle),
+    "wise_tweet": TweetPool("wise_tweet", functools.partial(live_wise_tweet, shared=False), is_idle=llm_idle),
+}
+
+def format_passages(passages):
+    """
+    Render retrieved passages as numbered, cited blocks for the LLM prompt.
+    """
+    if not passages:
+        return "I apologize, but I couldn't find relevant passages for this query."
+    blocks = []
+    for n, passage in enumerate(passages, start=1):
+        citation = passage.work if not passage.book else f"{passage.work}, Book {passage.book}"
+        blocks.append(f"[{n}] {citation}\n{passage.text}")
+    return "\n\n".join(blocks)
+
+RETRIEVAL_ERROR = "I apologize, but there was an error retrieving the context."
+
+def get_passages(question, persona):
+    """
+    Retrieve passages for a question; None when retrieval fails.
+    """
+    try:
+        return retrieve(question, author=persona)
+    except Exception as e:
+        print(f"Error retrieving context: {str(e)}")
+        return None
+
+def is_memory_question(question, chat_history):
+    return bool(chat_history) and question.lower().strip() in [
+        "what did we discuss?",
+        "what did we talk about?",
+        "what did we discuss in our previous messages?",
+        "what was our previous conversation about?"
+    ]
+
+def build_chat_context(query, chat_history, passages):
+    """
+    Pack retrieved passages (None when retrieval failed) and the conversation
+    history into the prompt context. Blocking (sentence embedding); run it
+    on the retrieval executor.
+    """
+    memory_question = is_memory_question(query.question, chat_history)
+
+    # Fit history and passages into the prompt's token budget
+    history, packed = pack_context(
+        query.question,
+        chat_history,
+        passages or [],
+        scorer=lambda question, sentences: score_sentences(question, sentences, author=query.persona),
+    )
+    rag_context = format_passages(packed) if passages is not None else RETRIEVAL_ERROR
+
+    if chat_history:
+        conversation_context = "Here's our conversation history:\n\n" + "\n".join(
+            format_history_line(msg) for msg in history
+        )
+        if memory_question:
+            context = conversation_context
+        else:
+            # Modified to explicitly request source citations and quotes
+            context = (
+                f"{conversation_context}\n\n"
+                f"Relevant passages from my works:\n{rag_context}\n\n"
+                "Please cite the specific work each quote comes from and explain its relevance to the question."
+            )
+    else:
+        # If no chat history, just use RAG context with quote request
+        context = (
+            f"Relevant background with original text:\n{rag_context}\n\n"
+            "Please include relevant quotes from the provided text in your response."
+        )
+    return context
 
 @api_v1_router.get("/health")
 async def health_check():
     return {"status": "ok"}
 
+@api_v1_router.get("/ready")
+async def readiness_check():
+    ready = readiness["retriever"] and readiness["llm"]
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "starting", **readiness},
+    )
+
+@api_v1_router.get("/cache/stats")
+async def retrieval_cache_stats():
+    return cache_stats()
+
+@api_v1_router.get("/cache/answers")
+async def answer_cache_stats():
+    return answer_cache.stats()
+
+@api_v1_router.get("/admission")
+async def admission_stats():
+    return {provider: controller.stats() for provider, controller in admission.items()}
+
+@api_v1_router.get("/tweets/pool")
+async def tweet_pool_stats():
+    return {name: pool.stats() for name, pool in tweet_pools.items()}
+
+@api_v1_router.get("/coalescing/stats")
+async def coalescing_stats():
+    return flights.stats()
+
+@api_v1_router.get("/shards")
+async def index_shards():
+    return shard_stats()
+
+@metrics.registry.collector
+def service_gauges():
+    """
+    Cache, queue and pool figures read at scrape time.
+    """
+    retrieval = cache_stats()
+    answers = answer_cache.stats()
+    coalescing = flights.stats()
+    controllers = {provider: controller.stats() for provider, controller in admission.items()}
+    db_pool = pool_stats()
+    return [
+        ("augustine_retrieval_cache_hits_total", "counter", "Retrieval cache hits",
+         [({"persona": persona, "cache": cache}, caches[cache]["hits"])
+          for persona, caches in retrieval.items() for cache in ("embeddings", "results")]),
+        ("augustine_retrieval_cache_misses_total", "counter", "Retrieval cache misses",
+         [({"persona": persona, "cache": cache}, caches[cache]["misses"])
+          for persona, caches in retrieval.items() for cache in ("embeddings", "results")]),
+        ("augustine_answer_cache_hits_total", "counter", "Semantic answer cache hits",
+         [({}, answers["hits"])]),
+        ("augustine_answer_cache_misses_total", "counter", "Semantic answer cache misses",
+         [({}, answers["misses"])]),
+        ("augustine_coalesced_calls_total", "counter", "Calls that joined an identical call in flight",
+         [({"kind": kind}, counts["coalesced"]) for kind, counts in coalescing.items()]),
+        ("augustine_llm_active", "gauge", "LLM calls holding a slot",
+         [({"provider": provider}, stats["active"]) for provider, stats in controllers.items()]),
+        ("augustine_llm_queued", "gauge", "LLM calls waiting for a slot",
+         [({"provider": provider}, stats["queued"]) for provider, stats in controllers.items()]),
+        ("augustine_llm_rejected_total", "counter", "LLM calls turned away with 429",
+         [({"provider": provider}, stats["rejected"] + stats["timed_out"]) for provider, stats in controllers.items()]),
+        ("augustine_tweet_pool_ready", "gauge", "Pre-generated tweets ready to serve",
+         [({"pool": name}, pool.stats()["ready"]) for name, pool in tweet_pools.items()]),
+        ("augustine_db_pool_in_use", "gauge", "MySQL pool connections checked out",
+         [({}, db_pool["in_use"])]),
+        ("augustine_db_pool_size", "gauge", "MySQL pool size", [({}, db_pool["size"])]),
+        ("augustine_executor_queue_depth", "gauge", "Blocking calls waiting for a worker thread",
+         [({"executor": "retrieval"}, retrieval_executor._work_queue.qsize()),
+          ({"executor": "db"}, db_executor._work_queue.qsize())]),
+    ]
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return Response(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+# Default and largest page of the history endpoint
+HISTORY_PAGE_SIZE = 50
+HISTORY_PAGE_MAX = 200
+
+async def open_session(query):
+    """
+    Resolve the session ID and load the recent history the prompt can use;
+    older messages never reach the context packer, so they are not read.
+    """
+    # Use existing session ID if provided, otherwise create new one
+    session_id = query.session_id if query.session_id else str(uuid.uuid4())
+
+    # Retrieve recent chat history for this session
+    with stage("history"):
+        chat_history = await run_in(db_executor, retrieve_recent_messages, session_id, HISTORY_MAX_MESSAGES)
+    return session_id, chat_history
+
+async def prepare_context(query, chat_history):
+    """
+    Retrieve passages and build the prompt context for a chat turn.
+    """
+    if is_memory_question(query.question, chat_history):
+        passages = []
+    else:
+        key = ("retrieve", query.persona, normalize_question(query.question))
+        with stage("retrieval"):
+            passages = await flights.run(key, run_in, retrieval_executor, get_passages, query.question, query.persona)
+    with stage("packing"):
+        return await run_in(retrieval_executor, build_chat_context, query, chat_history, passages)
+
+async def save_chat_turn(user_id, session_id, question, response):
+    """
+    Store both the new question and response. Returns the turn as messages
+    plus the cursor (ID of the response) for the history endpoint.
+    """
+    with stage("store"):
+        ids = await run_in(db_executor, store_chat_turn, user_id, session_id, question, response)
+    question_id, response_id = ids or (None, None)
+    messages = [
+        {"id": question_id, "role": "user", "message": question},
+        {"id": response_id, "role": "assistant", "message": response},
+    ]
+    return messages, response_id
+
+def sse_event(data, event=None):
+    """
+    Format one Server-Sent Event with a JSON payload.
+    """
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
 @api_v1_router.post("/chat")
 async def chat_with_augustine(query: Query):
+    require_ready("retriever")
+    reject_if_full("openai")
     try:
-        # Use existing session ID if provided, otherwise create new one
-        session_id = query.session_id if query.session_id else str(uuid.uuid4())
+        session_id, chat_history = await open_session(query)
         user_id = "default_user"
-        
-        # Retrieve existing chat history for this session
-        chat_history = retrieve_chat_history(session_id)
-        
-        # Format previous conversations for context
-        conversation_context = ""
-        # In the chat endpoint, modify the context building:
-        if chat_history:
-            conversation_context = "Here's our conversation history:\n\n" + "\n".join([
-                f"{'Human' if msg['role'] == 'user' else 'Augustine'}: {msg['message']}"
-                for msg in chat_history[-4:]  # Get last 4 messages for context
-            ])
-            
-            if query.question.lower().strip() in [
-                "what did we discuss?",
-                "what did we talk about?",
-                "what did we discuss in our previous messages?",
-                "what was our previous conversation about?"
-            ]:
-                context = conversation_context
-            # In the chat endpoint:
-            else:
-                # Modified to explicitly request source citations and quotes
-                rag_context = get_context(query.question, author=query.persona)
-                context = (
-                    f"{conversation_context}\n\n"
-                    f"Relevant passages from my works:\n{rag_context}\n\n"
-                    "Please cite the specific work each quote comes from and explain its relevance to the question."
+
+        # Without history the answer depends on the question alone
+        response, embedding = (None, None) if chat_history else await lookup_answer("chat", query)
+        if response is None:
+            context = await prepare_context(query, chat_history)
+
+            # Generate response; identical prompts in flight share one completion
+            context_hash = hashlib.sha1(context.encode("utf-8")).hexdigest()
+            with stage("llm"):
+                response = await flights.run(
+                    ("chat", query.persona, query.mode, normalize_question(query.question), context_hash),
+                    admitted,
+                    "openai",
+                    PRIORITY_CHAT,
+                    async_get_llm_response,
+                    question=query.question,
+                    context=context,
+                    mode=query.mode,
+                    persona=query.persona
                 )
-        else:
-            # If no chat history, just use RAG context with quote request
-            context = (
-                f"Relevant background with original text:\n{get_context(query.question, author=query.persona)}\n\n"
-                "Please include relevant quotes from the provided text in your response."
-            )
-        
-        # Generate response
-        response = get_llm_response(
-            question=query.question,
-            context=context,
-            mode=query.mode,
-            persona=query.persona
-        )
-        
-        # Store both the new question and response
-        store_chat_message(user_id, session_id, "user", query.question)
-        store_chat_message(user_id, session_id, "assistant", response)
+            remember_answer("chat", query, embedding, response)
         
+        # Only the new turn is returned; earlier messages come from /chat/{session_id}/history
+        messages, cursor = await save_chat_turn(user_id, session_id, query.question, response)
         return {
             "response": response,
             "session_id": session_id,
-            "chat_history": retrieve_chat_history(session_id)
+            "messages": messages,
+            "cursor": cursor
         }
+    except (HTTPException, Overloaded):
+        raise
+    except LLMError as e:
+        print(f"\nLLM error in chat endpoint: {str(e)}")
+        raise HTTPException(status_code=502, detail=str(e))
     except Exception as e:
         print(f"\nError in chat endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+
+@api_v1_router.post("/chat/stream")
+async def stream_chat_with_augustine(query: Query):
+    """
+    Chat as Server-Sent Events: a "session" event, one "token" event per
+    delta as the LLM produces it, then "done" with the full response. The
+    turn is stored once the stream completes; a failed stream ends with an
+    "error" event and is neither stored nor cached.
+    """
+    require_ready("retriever")
+    reject_if_full("openai")
+    try:
+        session_id, chat_history = await open_session(query)
+        cached, embedding = (None, None) if chat_history else await lookup_answer("chat", query)
+        context = None if cached is not None else await prepare_context(query, chat_history)
+    except Exception as e:
+        print(f"\nError in chat stream endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    user_id = "default_user"
+
+    async def events():
+        yield sse_event({"session_id": session_id}, "session")
+        if cached is not None:
+            yield sse_event({"token": cached}, "token")
+            messages, cursor = await save_chat_turn(user_id, session_id, query.question, cached)
+            yield sse_event({"session_id": session_id, "response": cached, "messages": messages, "cursor": cursor}, "done")
+            return
+        parts = []
+        try:
+            async with admission["openai"].slot(PRIORITY_CHAT):
+                with stage("llm"):
+                    start = time.perf_counter()
+                    async for delta in stream_llm_response(query.question, context, query.mode, query.persona):
+                        parts.append(delta)
+                        yield sse_event({"token": delta}, "token")
+        except Exception as e:
+            print(f"\nError in chat stream: {str(e)}")
+            yield sse_event({"detail": str(e)}, "error")
+            return
+        response = "".join(parts).strip()
+        record_generation("openai", approximate_tokens(response), time.perf_counter() - start)
+        remember_answer("chat", query, embedding, response)
+        messages, cursor = await save_chat_turn(user_id, session_id, query.question, response)
+        yield sse_event({"session_id": session_id, "response": response, "messages": messages, "cursor": cursor}, "done")
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@api_v1_router.get("/chat/{session_id}/history")
+async def chat_history_page(session_id: str, after: int | None = None, before: int | None = None,
+                            limit: int = HISTORY_PAGE_SIZE):
+    """
+    A page of the session's messages, oldest first. Pass the previous
+    page's `cursor` as `after` to read forward, or as `before` to read back
+    from the newest message (the default).
+    """
+    limit = max(1, min(limit, HISTORY_PAGE_MAX))
+    with stage("history"):
+        page = await run_in(db_executor, retrieve_chat_page, session_id, after, before, limit)
+    messages, has_more = page or ([], False)
+    if after is not None:
+        cursor = messages[-1]["id"] if messages else after
+    else:
+        cursor = messages[0]["id"] if messages else before
+    return {
+        "session_id": session_id,
+        "messages": messages,
+        "cursor": cursor,
+        "has_more": has_more
+    }
     
 
 @app.get("/tweet")
 async def generate_tweet():
+    require_ready("llm")
     try:
-        # Get prompts
-        prompts = load_tweet_prompts()
-        if not prompts:
-            raise HTTPException(status_code=500, detail="No prompts available")
-        
-        # Select random prompt
-        prompt = random.choice(prompts)
-        
-        # Add specific instruction for tweet length
-        full_prompt = f"Provide a tweet-length response (maximum 280 characters, no hashtags, no icons, no emojis) to: {prompt}"
-        
-        # Get response from Ollama
-        response = tweet_llm.complete(full_prompt)
-        tweet = str(response).strip()
-        tweet = " ".join(tweet.split())  # Replace all whitespace with single spaces
-        
-        # Ensure tweet length
-        if len(tweet) > 280:
-            tweet = tweet[:277] + "..."
-            
-        return TweetResponse(
-            tweet=tweet,
-            prompt=prompt
-        )
+        # Served from the pre-generated pool; generate live only when it is empty
+        with stage("pool"):
+            tweet = tweet_pools["tweet"].take()
+        if tweet:
+            return tweet
+        with stage("llm"):
+            return await live_tweet()
+    except (HTTPException, Overloaded):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
 @app.post("/tweet_response")
 async def generate_tweet_response(query: Query):
+    require_ready("llm")
     try:
         # Format the prompt to ensure a tweet-length response
         full_prompt = f"Provide a tweet-length response (maximum 280 characters, no hashtags, no icons, no emojis) to this message: {query.question}"
         
         # Get response from Ollama
-        response = tweet_llm.complete(full_prompt)
-        tweet = str(response).strip()
-        tweet = " ".join(tweet.split())  # Replace all whitespace with single spaces
-        
-        # Ensure tweet length
-        if len(tweet) > 280:
-            tweet = tweet[:277] + "..."
-            
-        return {"tweet": str(tweet)}
+        with stage("llm"):
+            response = await complete("tweet", tweet_llm, full_prompt)
+        return {"tweet": clean_tweet(response)}
+    except (HTTPException, Overloaded):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
 @app.get("/wise_tweet")
 async def generate_wise_tweet():
+    require_ready("llm")
     try:
-        # Direct request for a tweet-length wisdom
-        full_prompt = "Share a brief, profound spiritual insight or reflection in a tweet (maximum 280 characters, no hashtags, no icons, no emojis)."
-        
-        # Get response from Ollama
-        response = tweet_llm.complete(full_prompt)
-        tweet = str(response).strip()
-        
-        # Ensure tweet length
-        if len(tweet) > 280:
-            tweet = tweet[:277] + "..."
-            
-        return {"tweet": str(tweet)}
+        # Served from the pre-generated pool; generate live only when it is empty
+        with stage("pool"):
+            tweet = tweet_pools["wise_tweet"].take()
+        if tweet:
+            return tweet
+        with stage("llm"):
+            return await live_wise_tweet()
+    except (HTTPException, Overloaded):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-
-# Initialize Ollama with custom parameters
-llm = Ollama(
-    model="augustine",
-    temperature=0.7,
-    context_window=4096,  # Increased context window
-    max_tokens=1000,      # Increased max response length
-    num_predict=1000,     # Alternative way to control response length
-)
-
 @app.post("/ask")
 async def ask_augustine(query: Query):
+    require_ready("llm")
     try:
+        cached, embedding = await lookup_answer("ask", query)
+        if cached is not None:
+            return {"response": cached}
         # Use Ollama with completion parameters
-        response = llm.complete(
-            query.question,
-            temperature=0.7,
-            max_tokens=1000,
-            num_predict=1000
-        )
+        with stage("llm"):
+            response = await complete(
+                "ask",
+                llm,
+                query.question,
+                priority=PRIORITY_ASK,
+                temperature=0.7,
+                max_tokens=1000,
+                num_predict=1000
+            )
+        remember_answer("ask", query, embedding, str(response))
         return {"response": str(response)}
+    except (HTTPException, Overloaded):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/ask/stream")
+async def stream_ask_augustine(query: Query):
+    """
+    /ask as Server-Sent Events, forwarding Ollama's tokens as they arrive.
+    """
+    require_ready("llm")
+    reject_if_full("ollama")
+
+    async def events():
+        parts = []
+        try:
+            async with admission["ollama"].slot(PRIORITY_ASK):
+                with stage("llm"):
+                    start = time.perf_counter()
+                    stream = await llm.astream_complete(
+                        query.question,
+                        temperature=0.7,
+                        max_tokens=1000,
+                        num_predict=1000
+                    )
+                    async for chunk in stream:
+                        if chunk.delta:
+                            parts.append(chunk.delta)
+                            yield sse_event({"token": chunk.delta}, "token")
+        except Exception as e:
+            yield sse_event({"detail": str(e)}, "error")
+            return
+        record_generation("ollama", approximate_tokens("".join(parts)), time.perf_counter() - start)
+        yield sse_event({"response": "".join(parts)}, "done")
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/ready")
+async def ready_check():
+    return await readiness_check()
+
 app.include_router(api_v1_router)
 app.include_router(api_v2_router)
 
+# Server processes. Above 1, the index is paged in once and shared by all
+# workers through the OS page cache, each worker gets a share of the cores,
+# and the LLM slots stay box-wide; every worker still loads its own embedding model.
+WORKERS = int(os.getenv("WORKERS", "1"))
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8080"))
+
+def worker_environment(workers, cpus=None):
+    """
+    Environment for each of `workers` server processes: CPU threads and the
+    tweet pool size are split across them (unless set explicitly). The LLM
+    concurrency limits are not split: all workers share one set of slot
+    locks in LLM_SLOT_DIR, so each limit holds for the whole box.
+    """
+    cpus = cpus or os.cpu_count() or 1
+    threads = str(max(1, cpus // workers))
+    env = {
+        name: threads
+        for name in ("RAG_EMBED_THREADS", "OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+        if name not in os.environ
+    }
+    if "RETRIEVAL_WORKERS" not in os.environ:
+        env["RETRIEVAL_WORKERS"] = str(min(4, int(threads)))
+    if not os.getenv("LLM_SLOT_DIR"):
+        env["LLM_SLOT_DIR"] = tempfile.mkdtemp(prefix="augustine-llm-slots-")
+    env["TWEET_POOL_SIZE"] = str(TWEET_POOL_SIZE // workers)
+    if 0 < TWEET_POOL_SIZE < workers:
+        print(f"Warning: TWEET_POOL_SIZE={TWEET_POOL_SIZE} is below WORKERS={workers}, tweet pools are disabled")
+    return env
+
+def prepare_workers():
+    """
+    One-off work before the workers start, so they do not repeat or race
+    on it: page in the index shards and export the ONNX model if needed.
+    """
+    from embedding_backends import prepare_backend
+
+    RAG.shards.prefetch()
+    prepare_backend(RAG.EMBED_MODEL_NAME)
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8080)
\ No newline at end of file
+    if WORKERS > 1:
+        os.environ.update(worker_environment(WORKERS))
+        prepare_workers()
+        # Workers import the app themselves, so it is passed by name
+        uvicorn.run("main:app", host=HOST, port=PORT, workers=WORKERS,
+                    app_dir=os.path.dirname(os.path.abspath(__file__)))
+    else:
+        uvicorn.run(app, host=HOST, port=PORT)
\ No newline at end of file
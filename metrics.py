@@ -0,0 +1,187 @@
+# metrics.py
+"""
+Lightweight request metrics in the Prometheus text format.
+
+Histograms and counters are plain in-process objects guarded by a lock, so
+timing a stage costs a couple of perf_counter calls. `stage(name)` times a
+block into the stage latency histogram, labeled with the endpoint of the
+current request, and, when the request asked for it,
+into a per-request breakdown returned as a Server-Timing header. Gauges
+whose values live elsewhere (cache counters, queue depths) are read by
+collector callbacks at scrape time.
+"""
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+# Add Server-Timing to every response, not only those that send X-Timing: 1
+TIMING_HEADER = os.getenv("TIMING_HEADER", "0") == "1"
+# Share of LLM calls whose request details are logged
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+
+# ASGI scope of the current request, and its stage timings when a breakdown was requested
+current_scope = contextvars.ContextVar("current_scope", default=None)
+request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1.0):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for values, total in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, values)} {total}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for values, (counts, total, count) in sorted(self._series.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    labels = _labels(self.labels + ("le",), values + (bound,))
+                    lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+                labels = _labels(self.labels + ("le",), values + ("+Inf",))
+                lines.append(f"{self.name}_bucket{labels} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.labels, values)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labels, values)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, func):
+        """
+        Register `func() -> [(name, type, help, [(labels dict, value)])]`,
+        called at every scrape.
+        """
+        self.collectors.append(func)
+        return func
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collect in self.collectors:
+            try:
+                families = collect()
+            except Exception as e:
+                print(f"Error collecting metrics: {str(e)}")
+                continue
+            for name, kind, help, samples in families:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {float(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+stage_seconds = registry.register(Histogram(
+    "augustine_stage_seconds", "Latency of each request stage", labels=("endpoint", "stage")))
+request_seconds = registry.register(Histogram(
+    "augustine_request_seconds", "End-to-end request latency", labels=("path", "status")))
+llm_tokens = registry.register(Counter(
+    "augustine_llm_tokens_total", "Completion tokens generated", labels=("provider",)))
+llm_token_rate = registry.register(Histogram(
+    "augustine_llm_tokens_per_second", "Completion tokens per second of each LLM call",
+    labels=("provider",), buckets=TOKEN_RATE_BUCKETS))
+
+
+def endpoint_label():
+    """
+    Route template of the current request ("/api/v1/chat/{session_id}/history",
+    never the concrete path), so label values stay bounded. The router fills
+    in the route on the shared scope once it has matched the request.
+    """
+    scope = current_scope.get()
+    if scope is None:
+        return "background"
+    route = scope.get("route")
+    return route.path if route is not None else "unmatched"
+
+
+@contextmanager
+def stage(name):
+    """Time a block as one stage of the current request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_seconds.observe(elapsed, endpoint_label(), name)
+        timings = request_timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def record_generation(provider, tokens, elapsed):
+    llm_tokens.inc(provider, amount=tokens)
+    if elapsed > 0 and tokens:
+        llm_token_rate.observe(tokens / elapsed, provider)
+
+
+def server_timing(timings):
+    """Server-Timing header value, durations in milliseconds."""
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
+
+
+def log_sampled(event, rate=LOG_SAMPLE_RATE, **fields):
+    """Print one JSON log line for a random `rate` share of calls."""
+    if rate > 0 and random.random() < rate:
+        print(json.dumps({"event": event, "ts": round(time.time(), 3), **fields}, default=str))
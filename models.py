@@ -10,4 +10,11 @@ class Query(BaseModel):
 class TweetResponse(BaseModel):
     tweet: str
     prompt: str
-    
\ No newline at end of file
+
+class Passage(BaseModel):
+    text: str
+    work: str
+    book: str | None = None
+    file_name: str
+    score: float
+    sources: list[str] = Field(default_factory=list, description="Every file this passage appears in")
@@ -1,8 +1,9 @@
 # mysql_memory.py
 
-import mysql.connector
 from mysql.connector import Error
+from mysql.connector import pooling
 import os
+import threading
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -13,23 +14,53 @@ MYSQL_HOST = os.getenv('MYSQL_HOST')
 MYSQL_USER = os.getenv('MYSQL_USER')
 MYSQL_PASS = os.getenv('MYSQL_PASS')
 MYSQL_DB = os.getenv('MYSQL_DB')
+# Pooled connections; match the API's DB executor size so no call waits on the pool
+MYSQL_POOL_SIZE = int(os.getenv('MYSQL_POOL_SIZE', '8'))
+
+_pool = None
+_pool_lock = threading.Lock()
+# Connections currently checked out of the pool
+pool_in_use = 0
+
+def get_pool():
+    """Create the connection pool on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = pooling.MySQLConnectionPool(
+                    pool_name="augustine",
+                    pool_size=MYSQL_POOL_SIZE,
+                    host=MYSQL_HOST,
+                    user=MYSQL_USER,
+                    password=MYSQL_PASS,
+                    database=MYSQL_DB
+                )
+                print("Connected to MySQL database")
+    return _pool
 
 def create_connection():
-    """Create a database connection."""
+    """Take a database connection from the pool; close() returns it."""
+    global pool_in_use
     try:
-        connection = mysql.connector.connect(
-            host=MYSQL_HOST,
-            user=MYSQL_USER,
-            password=MYSQL_PASS,
-            database=MYSQL_DB
-        )
-        if connection.is_connected():
-            print("Connected to MySQL database")
+        connection = get_pool().get_connection()
+        with _pool_lock:
+            pool_in_use += 1
         return connection
     except Error as e:
         print(f"Error: {e}")
         return None
 
+def release_connection(connection):
+    """Return a connection to the pool."""
+    global pool_in_use
+    connection.close()
+    with _pool_lock:
+        pool_in_use -= 1
+
+def pool_stats():
+    return {"size": MYSQL_POOL_SIZE, "in_use": pool_in_use}
+
 def store_chat_message(user_id, session_id, role, message):
     """Store a chat message in the database."""
     connection = create_connection()
@@ -43,11 +74,12 @@ def store_chat_message(user_id, session_id, role, message):
             cursor.execute(query, (user_id, session_id, role, message))
             connection.commit()
             print("Message stored successfully")
+            return cursor.lastrowid
         except Error as e:
             print(f"Error: {e}")
         finally:
             cursor.close()
-            connection.close()
+            release_connection(connection)
 
 def retrieve_chat_history(session_id):
     """Retrieve chat history for a session."""
@@ -64,4 +96,84 @@ def retrieve_chat_history(session_id):
             return []
         finally:
             cursor.close()
-            connection.close()
\ No newline at end of file
+            release_connection(connection)
+
+def store_chat_turn(user_id, session_id, question, response):
+    """
+    Store a question and its response in one transaction. Returns the IDs
+    of the two rows, or None on error.
+    """
+    connection = create_connection()
+    if connection:
+        try:
+            cursor = connection.cursor()
+            query = """
+            INSERT INTO chat_ui_history (user_id, session_id, role, message)
+            VALUES (%s, %s, %s, %s)
+            """
+            cursor.execute(query, (user_id, session_id, "user", question))
+            question_id = cursor.lastrowid
+            cursor.execute(query, (user_id, session_id, "assistant", response))
+            response_id = cursor.lastrowid
+            connection.commit()
+            return question_id, response_id
+        except Error as e:
+            print(f"Error: {e}")
+            connection.rollback()
+            return None
+        finally:
+            cursor.close()
+            release_connection(connection)
+
+def retrieve_recent_messages(session_id, limit):
+    """The newest `limit` messages of a session, oldest first."""
+    connection = create_connection()
+    if connection:
+        try:
+            cursor = connection.cursor(dictionary=True)
+            query = """
+            SELECT id, role, message, timestamp FROM chat_ui_history
+            WHERE session_id = %s ORDER BY id DESC LIMIT %s
+            """
+            cursor.execute(query, (session_id, limit))
+            return cursor.fetchall()[::-1]
+        except Error as e:
+            print(f"Error: {e}")
+            return []
+        finally:
+            cursor.close()
+            release_connection(connection)
+
+def retrieve_chat_page(session_id, after=None, before=None, limit=50):
+    """
+    One page of a session's messages, oldest first, by keyset on id: those
+    after the `after` ID, or the newest ones before `before` (or overall).
+    Fetches one extra row to tell whether more remain; returns
+    (messages, has_more).
+    """
+    connection = create_connection()
+    if connection:
+        try:
+            cursor = connection.cursor(dictionary=True)
+            if after is not None:
+                query = """
+                SELECT id, role, message, timestamp FROM chat_ui_history
+                WHERE session_id = %s AND id > %s ORDER BY id LIMIT %s
+                """
+                cursor.execute(query, (session_id, after, limit + 1))
+            else:
+                query = """
+                SELECT id, role, message, timestamp FROM chat_ui_history
+                WHERE session_id = %s AND id < %s ORDER BY id DESC LIMIT %s
+                """
+                cursor.execute(query, (session_id, before if before is not None else 2**63 - 1, limit + 1))
+            records = cursor.fetchall()
+            has_more = len(records) > limit
+            records = records[:limit]
+            return (records if after is not None else records[::-1]), has_more
+        except Error as e:
+            print(f"Error: {e}")
+            return [], False
+        finally:
+            cursor.close()
+            release_connection(connection)
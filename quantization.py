@@ -0,0 +1,116 @@
+# quantization.py
+"""
+Quantized copies of the embedding matrix for the candidate scan.
+
+"float16" halves the matrix; "int8" stores one byte per dimension with a
+per-dimension scale and offset (value ~= offset + code * scale), a quarter of
+float32. Searches scan the quantized copy, then re-score a short list against
+the full-precision matrix, which stays mmapped on disk and is only paged in
+for those rows.
+
+Run `python quantization.py [store_dir]` to compare recall@k of the quantized
+search against the exact float32 baseline.
+"""
+import os
+import sys
+
+import numpy as np
+
+from store_io import save_npy
+
+QUANTIZATION = os.getenv("RAG_QUANTIZATION", "int8")
+KINDS = ("float16", "int8")
+
+FLOAT16_FILE = "embeddings_f16.npy"
+INT8_FILE = "embeddings_int8.npy"
+INT8_SCALE_FILE = "int8_scale.npy"
+INT8_OFFSET_FILE = "int8_offset.npy"
+QUANTIZED_FILES = {"float16": (FLOAT16_FILE,), "int8": (INT8_FILE, INT8_SCALE_FILE, INT8_OFFSET_FILE)}
+
+# Rows de-quantized per block while scanning, to bound temporary memory
+SCAN_BLOCK = 16384
+# Short list re-scored in full precision: max(top_k * factor, minimum)
+RESCORE_FACTOR = 4
+RESCORE_MIN = 50
+
+
+def remove_quantized(store_dir):
+    for name in (name for names in QUANTIZED_FILES.values() for name in names):
+        path = os.path.join(store_dir, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def write_quantized(store_dir, matrix, kind=QUANTIZATION):
+    """Persist a quantized copy of `matrix`; returns the kind written or None."""
+    remove_quantized(store_dir)
+    if kind not in KINDS or matrix.ndim != 2 or len(matrix) == 0:
+        return None
+    if kind == "float16":
+        save_npy(os.path.join(store_dir, FLOAT16_FILE), matrix.astype(np.float16))
+        return kind
+    low, high = matrix.min(axis=0), matrix.max(axis=0)
+    scale = (high - low) / 255.0
+    scale[scale == 0] = 1.0
+    codes = np.clip(np.rint((matrix - low) / scale), 0, 255).astype(np.uint8)
+    save_npy(os.path.join(store_dir, INT8_FILE), codes)
+    save_npy(os.path.join(store_dir, INT8_SCALE_FILE), scale.astype(np.float32))
+    save_npy(os.path.join(store_dir, INT8_OFFSET_FILE), low.astype(np.float32))
+    return kind
+
+
+class QuantizedMatrix:
+    """Approximate dot products against a quantized copy of the store."""
+
+    def __init__(self, store_dir, kind):
+        self.kind = kind
+        if kind == "float16":
+            self.codes = np.load(os.path.join(store_dir, FLOAT16_FILE), mmap_mode="r")
+        else:
+            self.codes = np.load(os.path.join(store_dir, INT8_FILE), mmap_mode="r")
+            self.scale = np.load(os.path.join(store_dir, INT8_SCALE_FILE))
+            self.offset = np.load(os.path.join(store_dir, INT8_OFFSET_FILE))
+
+    def scores(self, query, rows=None):
+        """Approximate query . row for every row (or only `rows`)."""
+        codes = self.codes if rows is None else self.codes[rows]
+        if self.kind == "float16":
+            weights, bias = query, 0.0
+        else:
+            # q . (offset + code * scale) = code . (q * scale) + q . offset
+            weights, bias = query * self.scale, float(query @ self.offset)
+        out = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), SCAN_BLOCK):
+            block = np.asarray(codes[start:start + SCAN_BLOCK], dtype=np.float32)
+            out[start:start + SCAN_BLOCK] = block @ weights
+        return out + bias
+
+
+def shortlist_size(top_k):
+    return max(top_k * RESCORE_FACTOR, RESCORE_MIN)
+
+
+def recall_check(store, queries, top_k=10):
+    """Mean recall@k of the default (quantized/ANN) search vs exact float32."""
+    recalls = []
+    for query in queries:
+        approximate = {i for i, _ in store.search(query, top_k=top_k)}
+        exact = {i for i, _ in store.search(query, top_k=top_k, exact=True)}
+        recalls.append(len(approximate & exact) / max(1, len(exact)))
+    return float(np.mean(recalls)) if recalls else 1.0
+
+
+if __name__ == "__main__":
+    from embedding_store import STORE_DIR, EmbeddingStore
+
+    store = EmbeddingStore(sys.argv[1] if len(sys.argv) > 1 else STORE_DIR)
+    rng = np.random.default_rng(0)
+    # Perturbed stored passages stand in for real queries
+    rows = rng.choice(len(store), min(200, len(store)), replace=False)
+    queries = np.asarray(store.embeddings[np.sort(rows)], dtype=np.float32)
+    queries += rng.normal(scale=0.05, size=queries.shape).astype(np.float32)
+    quantized = store.quantized.kind if store.quantized else "none"
+    codes_mb = store.quantized.codes.nbytes / 2**20 if store.quantized else 0.0
+    print(f"Quantization: {quantized} ({codes_mb:.1f} MB scanned vs {store.embeddings.nbytes / 2**20:.1f} MB float32)")
+    for k in (3, 10):
+        print(f"recall@{k} vs exact: {recall_check(store, queries, k):.4f}")
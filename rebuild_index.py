@@ -1,11 +1,20 @@
 # rebuild_index.py
-from llama_index.core import VectorStoreIndex, StorageContext
-from llama_index.core import SimpleDirectoryReader
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+import argparse
+from embedding_store import STORE_DIR, export_index
+from index_pipeline import BATCH_SIZE, build_store
+
+EMBED_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
 
 def rebuild_index():
+    """
+    Legacy build: llama-index VectorStoreIndex over the raw files, exported
+    to the embedding store. No boilerplate stripping or de-duplication.
+    """
+    from llama_index.core import VectorStoreIndex, SimpleDirectoryReader
+    from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+
     print("Loading embedding model...")
-    embed_model = HuggingFaceEmbedding(model_name="sentence-transformers/all-MiniLM-L6-v2")
+    embed_model = HuggingFaceEmbedding(model_name=EMBED_MODEL_NAME)
     
     print("Loading documents...")
     documents = SimpleDirectoryReader("./augustine_texts").load_data()
@@ -19,7 +28,29 @@ def rebuild_index():
     print("Saving index...")
     index.storage_context.persist(persist_dir="./augustine_index")
     
+    print("Writing embedding store...")
+    export_index(index, STORE_DIR, EMBED_MODEL_NAME)
+    
     print("Index rebuilt successfully!")
 
 if __name__ == "__main__":
-    rebuild_index()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Rebuild the Augustine index")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Embedding processes (default: one per core)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help="Chunks per embedding batch")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only re-embed files added or changed since the last build")
+    parser.add_argument("--no-dedup", action="store_true",
+                        help="Keep repeated passages (FULL_TEXT vs BOOK files) instead of indexing them once")
+    parser.add_argument("--legacy-llama-index", action="store_true",
+                        help="Build a llama-index VectorStoreIndex (./augustine_index) and export it instead; "
+                             "no boilerplate stripping or de-duplication")
+    args = parser.parse_args()
+
+    if args.legacy_llama_index:
+        rebuild_index()
+    else:
+        build_store(model_name=EMBED_MODEL_NAME, workers=args.workers, batch_size=args.batch_size,
+                    incremental=args.incremental, dedup=not args.no_dedup)
+        print("Index rebuilt successfully!")
\ No newline at end of file
@@ -0,0 +1,195 @@
+# shard_registry.py
+"""
+Registry of per-persona index shards.
+
+Each persona (Augustine, Freud, ...) has its own embedding store directory.
+Shards are opened on first use, pinned while a request holds them, and the
+least recently used unpinned shards are dropped once the mapped size of all
+open shards exceeds the memory budget. A shard whose CURRENT pointer changed
+on disk (the store was rebuilt) is reopened, with empty retrieval caches;
+requests still holding the old one finish on its mappings.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from caching import RetrievalCache
+from embedding_store import CURRENT_FILE, MANIFEST_FILE, scanned_files, store_exists
+
+DEFAULT_PERSONA = "Augustine"
+# "Augustine=./augustine_store,Freud=./freud_store"
+SHARDS = os.getenv("RAG_SHARDS", "")
+# 0 disables eviction
+SHARD_MEMORY_MB = float(os.getenv("RAG_SHARD_MEMORY_MB", "0"))
+# Seconds between checks of a shard's CURRENT pointer for a rebuild; 0 disables
+STORE_CHECK_INTERVAL = float(os.getenv("RAG_STORE_CHECK_INTERVAL", "5"))
+PREFETCH_CHUNK = 1 << 20
+
+
+def parse_shards(spec, default_dir):
+    """Parse RAG_SHARDS into {persona: store_dir}; the default persona always has a shard."""
+    shards = {DEFAULT_PERSONA: default_dir}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        persona, _, store_dir = item.partition("=")
+        shards[persona.strip()] = store_dir.strip()
+    return shards
+
+
+def store_mtime(store_dir):
+    """Changes whenever a build is switched in: the CURRENT pointer, or store.json of a flat store."""
+    for name in (CURRENT_FILE, MANIFEST_FILE):
+        try:
+            return os.stat(os.path.join(store_dir, name)).st_mtime_ns
+        except OSError:
+            continue
+    return None
+
+
+def directory_size(path):
+    return sum(
+        os.path.getsize(os.path.join(path, name))
+        for name in os.listdir(path)
+        if os.path.isfile(os.path.join(path, name))
+    )
+
+
+def prefetch_files(paths, chunk_size=PREFETCH_CHUNK):
+    """Read each file once so its pages are in the OS page cache."""
+    for file_path in paths:
+        if not os.path.isfile(file_path):
+            continue
+        with open(file_path, "rb", buffering=0) as f:
+            while f.read(chunk_size):
+                pass
+
+
+class Shard:
+    """An opened persona index, its retrieval cache and bookkeeping."""
+
+    def __init__(self, persona, store_dir, store, bm25, store_mtime=None):
+        self.persona = persona
+        self.store_dir = store_dir
+        self.store = store
+        self.bm25 = bm25
+        self.cache = RetrievalCache()
+        self.store_mtime = store_mtime
+        self.checked = time.monotonic()
+        self.size_bytes = directory_size(store.path)
+        self.pins = 0
+        self.last_used = time.monotonic()
+
+
+class ShardRegistry:
+    """Loads shards lazily and evicts unpinned ones over the memory budget."""
+
+    def __init__(self, shard_dirs, loader, memory_budget_mb=SHARD_MEMORY_MB, check_interval=STORE_CHECK_INTERVAL):
+        """`loader(persona, store_dir)` returns the shard's (store, bm25)."""
+        self.shard_dirs = dict(shard_dirs)
+        self.loader = loader
+        self.memory_budget = int(memory_budget_mb * 2**20)
+        self.check_interval = check_interval
+        self.shards = {}
+        self.loads = 0
+        self.reloads = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._loading = {}
+
+    def resolve(self, persona):
+        """Personas without a corpus of their own use the default shard."""
+        return persona if persona in self.shard_dirs else DEFAULT_PERSONA
+
+    def _load(self, persona):
+        # One loader per persona at a time; other personas stay available
+        with self._lock:
+            lock = self._loading.setdefault(persona, threading.Lock())
+        with lock:
+            with self._lock:
+                shard = self.shards.get(persona)
+            if shard is not None:
+                return shard
+            store_dir = self.shard_dirs[persona]
+            print(f"Loading {persona} shard from {store_dir}")
+            # Taken before opening, so a build switched in meanwhile is noticed
+            mtime = store_mtime(store_dir)
+            shard = Shard(persona, store_dir, *self.loader(persona, store_dir), store_mtime=mtime)
+            with self._lock:
+                self.shards[persona] = shard
+                self.loads += 1
+            return shard
+
+    @contextmanager
+    def acquire(self, persona):
+        """Pin the persona's shard for the duration of the block."""
+        persona = self.resolve(persona)
+        with self._lock:
+            shard = self.shards.get(persona)
+            if shard is not None and self._rebuilt(shard):
+                print(f"{persona} store changed on disk, reopening shard")
+                del self.shards[persona]
+                self.reloads += 1
+                shard = None
+            if shard is not None:
+                shard.pins += 1
+        if shard is None:
+            shard = self._load(persona)
+            with self._lock:
+                shard.pins += 1
+        try:
+            yield shard
+        finally:
+            with self._lock:
+                shard.pins -= 1
+                shard.last_used = time.monotonic()
+                self._evict()
+
+    def _rebuilt(self, shard):
+        """True when another build was switched in since the shard was opened (lock held)."""
+        now = time.monotonic()
+        if not self.check_interval or now - shard.checked < self.check_interval:
+            return False
+        shard.checked = now
+        mtime = store_mtime(shard.store_dir)
+        return mtime is not None and mtime != shard.store_mtime
+
+    def _evict(self):
+        """Drop least recently used unpinned shards until under budget (lock held)."""
+        if not self.memory_budget:
+            return
+        total = sum(shard.size_bytes for shard in self.shards.values())
+        for shard in sorted(self.shards.values(), key=lambda s: s.last_used):
+            if total <= self.memory_budget:
+                break
+            if shard.pins:
+                continue
+            print(f"Evicting {shard.persona} shard ({shard.size_bytes / 2**20:.1f} MB)")
+            del self.shards[shard.persona]
+            total -= shard.size_bytes
+            self.evictions += 1
+
+    def prefetch(self):
+        """
+        Page in the files every search scans for each configured shard, e.g.
+        before starting server workers, which then map the same cached pages
+        instead of reading from disk.
+        """
+        for persona, store_dir in self.shard_dirs.items():
+            if store_exists(store_dir):
+                print(f"Prefetching {persona} shard from {store_dir}")
+                prefetch_files(scanned_files(store_dir))
+
+    def loaded(self):
+        with self._lock:
+            return list(self.shards.values())
+
+    def stats(self):
+        with self._lock:
+            return {
+                "loaded": {p: {"mb": s.size_bytes / 2**20, "pins": s.pins} for p, s in self.shards.items()},
+                "configured": sorted(self.shard_dirs),
+                "memory_budget_mb": self.memory_budget / 2**20,
+                "loads": self.loads,
+                "reloads": self.reloads,
+                "evictions": self.evictions,
+            }
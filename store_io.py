@@ -0,0 +1,27 @@
+# store_io.py
+"""
+Atomic writes for the embedding store files.
+
+Each file is written next to its destination and swapped in with os.replace,
+so a reader (or a crashed rebuild) never sees a half-written file.
+"""
+import json
+import os
+
+import numpy as np
+
+
+def replace_file(path, write, mode="wb"):
+    """Call write(f) on a temporary file, then swap it in for `path`."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, mode) as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def save_npy(path, array):
+    replace_file(path, lambda f: np.save(f, array))
+
+
+def save_json(path, data, **kwargs):
+    replace_file(path, lambda f: json.dump(data, f, **kwargs), mode="w")
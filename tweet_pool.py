@@ -0,0 +1,80 @@
+# tweet_pool.py
+"""
+Pre-generated tweets.
+
+Each pool keeps a bounded buffer of ready tweets that a background task
+refills while the LLM is otherwise idle, so the tweet endpoints answer from
+memory instead of waiting on a live generation.
+"""
+import asyncio
+import os
+
+TWEET_POOL_SIZE = int(os.getenv("TWEET_POOL_SIZE", "5"))
+# Seconds to wait before checking again while requests are using the LLM
+TWEET_POOL_IDLE_WAIT = float(os.getenv("TWEET_POOL_IDLE_WAIT", "2"))
+# Seconds to back off after a failed generation
+TWEET_POOL_RETRY_WAIT = float(os.getenv("TWEET_POOL_RETRY_WAIT", "30"))
+
+
+class TweetPool:
+    """Bounded buffer of tweets produced by `generate()` in the background."""
+
+    def __init__(self, name, generate, size=TWEET_POOL_SIZE, is_idle=None):
+        """`generate` is an async callable; `is_idle()` says whether to produce now."""
+        self.name = name
+        self.generate = generate
+        self.size = size
+        self.is_idle = is_idle or (lambda: True)
+        self.served = 0
+        self.misses = 0
+        self.produced = 0
+        self._buffer = asyncio.Queue(maxsize=max(size, 1))
+        self._task = None
+
+    def take(self):
+        """A ready tweet, or None when the pool is empty."""
+        try:
+            tweet = self._buffer.get_nowait()
+        except asyncio.QueueEmpty:
+            self.misses += 1
+            return None
+        self.served += 1
+        return tweet
+
+    async def _produce(self):
+        while True:
+            if self._buffer.full() or not self.is_idle():
+                await asyncio.sleep(TWEET_POOL_IDLE_WAIT)
+                continue
+            try:
+                tweet = await self.generate()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error pre-generating {self.name} tweet: {str(e)}")
+                await asyncio.sleep(TWEET_POOL_RETRY_WAIT)
+                continue
+            self._buffer.put_nowait(tweet)
+            self.produced += 1
+
+    def start(self):
+        if self.size > 0 and self._task is None:
+            self._task = asyncio.create_task(self._produce())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {
+            "ready": self._buffer.qsize(),
+            "size": self.size,
+            "produced": self.produced,
+            "served": self.served,
+            "misses": self.misses,
+        }